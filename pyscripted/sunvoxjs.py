@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import time
 from ctypes import POINTER, c_uint32, c_int16, c_float, Structure, c_ubyte, c_ushort
 
 import js
+import numpy as np
 
 # noinspection PyUnresolvedReferences
 from js import console, svlib
@@ -95,6 +97,112 @@ class sunvox_note(Structure):
     ]
 
 
+# A sunvox_note as a NumPy record, for building batches of events.
+NOTE_DTYPE = np.dtype(sunvox_note)
+
+# One event of a batch as it is laid out in the SunVox heap: 16 bytes, read by
+# SEND_EVENTS_JS below.
+EVENT_DTYPE = np.dtype(
+    [
+        ("t", "<u4"),
+        ("track", "<i4"),
+        ("note", "u1"),
+        ("vel", "u1"),
+        ("module", "<u2"),
+        ("ctl", "<u2"),
+        ("ctl_val", "<u2"),
+    ]
+)
+
+# Sends a batch of events from the heap in one call from Python, optionally
+# setting each event's time first. Returns the number of events sent.
+SEND_EVENTS_JS = """
+(function (slot, ptr, count, timed) {
+    var u8 = svlib.HEAPU8, u16 = svlib.HEAPU16;
+    var i32 = svlib.HEAP32, u32 = svlib.HEAPU32;
+    var sent = 0;
+    for (var i = 0; i < count; i++) {
+        var b = ptr + i * 16;
+        if (timed) svlib._sv_set_event_t(slot, 1, u32[b >> 2]);
+        var rv = svlib._sv_send_event(
+            slot, i32[(b + 4) >> 2], u8[b + 8], u8[b + 9],
+            u16[(b + 10) >> 1], u16[(b + 12) >> 1], u16[(b + 14) >> 1]
+        );
+        if (rv == 0) sent++;
+    }
+    if (timed) svlib._sv_set_event_t(slot, 0, 0);
+    return sent;
+})
+"""
+
+# Allocated on first use and grown as needed, like the JS glue's own buffers.
+send_events_js = None
+event_buf: HeapBuffer | None = None
+
+# Typed array views of the SunVox WASM heap, and the shift that turns a byte
+# address into an index into them.
+HEAP_VIEWS = {
+    np.dtype(np.int16): ("HEAP16", 1),
+    np.dtype(np.uint32): ("HEAPU32", 2),
+    np.dtype(np.float32): ("HEAPF32", 2),
+}
+
+
+class HeapBuffer:
+    """
+    a buffer allocated once inside the SunVox WASM heap, mirrored by a NumPy array
+
+    The *_heap functions of SunVoxApi pass `ptr` straight to SunVox, so no
+    memory is allocated and no JS typed array is created per call. pull() copies
+    the heap into `array` and push() copies `array` into the heap, each in one
+    bulk copy: Python and SunVox run in separate WASM memories, so that copy is
+    the only one left.
+
+    Call free() when done, or use the buffer as a context manager.
+    """
+
+    def __init__(self, dtype, length: int):
+        self.dtype = np.dtype(dtype)
+        self.heap_name, self.shift = HEAP_VIEWS[self.dtype]
+        self.length = length
+        self.array = np.zeros(length, self.dtype)
+        self.ptr = js.svlib._malloc(max(length, 1) * self.dtype.itemsize)
+
+    def heap_view(self, count: int | None = None):
+        # The heap's typed arrays are replaced whenever the WASM memory grows,
+        # so the view is taken again every time.
+        count = self.length if count is None else min(count, self.length)
+        start = self.ptr >> self.shift
+        return getattr(js.svlib, self.heap_name).subarray(start, start + count)
+
+    def pull(self, count: int | None = None) -> np.ndarray:
+        """
+        copy the first `count` items from the heap; return them as a view of `array`
+        """
+        view = self.heap_view(count)
+        dest = self.array[: view.length]
+        view.assign_to(dest)
+        return dest
+
+    def push(self, count: int | None = None):
+        """
+        copy the first `count` items of `array` to the heap
+        """
+        view = self.heap_view(count)
+        view.assign(self.array[: view.length])
+
+    def free(self):
+        if self.ptr:
+            js.svlib._free(self.ptr)
+            self.ptr = 0
+
+    def __enter__(self) -> HeapBuffer:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.free()
+
+
 class SunVoxApi:
 
     # Initialization of SunVox WASM
@@ -208,6 +316,35 @@ class SunVoxApi:
         """
         return sv_audio_callback(buf, frames, latency, out_time)
 
+    @staticmethod
+    def audio_callback_heap(
+        buf: HeapBuffer,
+        frames: int,
+        latency: int,
+        out_time: int,
+    ) -> int:
+        """
+        same as audio_callback(), but renders into a HeapBuffer.
+
+        buf must be int16 or float32 to match the INIT_FLAG.AUDIO_xxx flags, and
+        hold at least frames * channels items. Afterwards, buf.array starts with
+        the interleaved audio: buf.array[:frames * 2].reshape(frames, 2).
+
+        Raises ValueError if buf is too small, since SunVox would write past it.
+
+        Return values: 0 - silence (buffer filled with zeroes); 1 - some signal.
+        """
+        count = frames * 2
+        if count > buf.length:
+            raise ValueError(f"{frames} frames do not fit in {buf.length} items")
+        rv = js.svlib._sv_audio_callback(buf.ptr, frames, latency, out_time)
+        if rv == 0:
+            # Nothing to copy: the heap holds zeroes too.
+            buf.array[:count] = 0
+        else:
+            buf.pull(count)
+        return rv
+
     @staticmethod
     def audio_callback2(
         buf: bytes,
@@ -501,6 +638,47 @@ class SunVoxApi:
         """
         return sv_send_event(slot, track_num, note, vel, module, ctl, ctl_val)
 
+    @staticmethod
+    def send_events(
+        slot: int,
+        track_nums,
+        notes: np.ndarray,
+        t=None,
+    ) -> int:
+        """
+        send a batch of events in one call, instead of one send_event() call each
+
+        Parameters:
+          slot;
+          track_nums - track number of each event, or one for all of them;
+          notes - array of NOTE_DTYPE records (the fields of sunvox_note);
+          t -
+            None to process the events as quickly as possible, or the time of
+            each event (in system ticks, SunVox time space), set with
+            set_event_t() before sending it; automatic time setting is restored
+            afterwards.
+
+        Return value: number of events sent successfully.
+        """
+        global send_events_js, event_buf
+        notes = np.asarray(notes, NOTE_DTYPE).ravel()
+        count = len(notes)
+        if not count:
+            return 0
+        if event_buf is None or event_buf.length < count * 4:
+            if event_buf is not None:
+                event_buf.free()
+            event_buf = HeapBuffer(np.uint32, count * 4)
+        if send_events_js is None:
+            send_events_js = js.eval(SEND_EVENTS_JS)
+        events = event_buf.array[: count * 4].view(EVENT_DTYPE)
+        events["track"] = track_nums
+        events["t"] = 0 if t is None else t
+        for name in NOTE_DTYPE.names:
+            events[name] = notes[name]
+        event_buf.push(count * 4)
+        return send_events_js(slot, event_buf.ptr, count, t is not None)
+
     @staticmethod
     def get_current_line(slot: int) -> int:
         """
@@ -576,6 +754,26 @@ class SunVoxApi:
         """
         return sv_get_time_map(slot, start_line, len, dest, flags)
 
+    @staticmethod
+    def get_time_map_heap(
+        slot: int,
+        start_line: int,
+        len: int,
+        dest: HeapBuffer,
+        flags: int,
+    ) -> int:
+        """
+        same as get_time_map(), but reads into a uint32 HeapBuffer;
+        on success, dest.array[:len] holds the map values.
+        Raises ValueError if dest holds fewer than len items.
+        """
+        if len > dest.length:
+            raise ValueError(f"{len} lines do not fit in {dest.length} items")
+        rv = js.svlib._sv_get_time_map(slot, start_line, len, dest.ptr, flags)
+        if rv == 0:
+            dest.pull(len)
+        return rv
+
     @staticmethod
     def new_module(
         slot: int,
@@ -782,6 +980,26 @@ class SunVoxApi:
         """
         return sv_get_module_scope2(slot, mod_num, channel, dest_buf, samples_to_read)
 
+    @staticmethod
+    def get_module_scope2_heap(
+        slot: int,
+        mod_num: int,
+        channel: int,
+        dest: HeapBuffer,
+        samples_to_read: int,
+    ) -> int:
+        """
+        same as get_module_scope2(), but reads into an int16 HeapBuffer;
+        dest.array[:received] holds the samples.
+        """
+        samples_to_read = min(samples_to_read, dest.length)
+        rv = js.svlib._sv_get_module_scope2(
+            slot, mod_num, channel, dest.ptr, samples_to_read
+        )
+        if rv > 0:
+            dest.pull(rv)
+        return rv
+
     @staticmethod
     def module_curve(
         slot: int,
@@ -817,6 +1035,29 @@ class SunVoxApi:
         """
         return sv_module_curve(slot, mod_num, curve_num, data, len, w)
 
+    @staticmethod
+    def module_curve_heap(
+        slot: int,
+        mod_num: int,
+        curve_num: int,
+        data: HeapBuffer,
+        len: int,
+        w: int,
+    ) -> int:
+        """
+        same as module_curve(), but with a float32 HeapBuffer:
+        writes (w == 1) data.array[:len], or reads (w == 0) into it.
+
+        return value: number of items processed successfully.
+        """
+        len = min(len, data.length)
+        if w == 1:
+            data.push(len)
+        rv = js.svlib._sv_module_curve(slot, mod_num, curve_num, data.ptr, len, w)
+        if w == 0 and rv > 0:
+            data.pull(rv)
+        return rv
+
     @staticmethod
     def get_number_of_module_ctls(
         slot: int,
@@ -1040,3 +1281,35 @@ class SunVoxApi:
         Return value: pointer to the null-terminated string with the latest log messages.
         """
         return sv_get_log(size)
+
+
+def benchmark_send_events(slot: int, count: int = 10000) -> dict:
+    """
+    compare the throughput of send_event() and send_events()
+
+    Sends `count` empty events (note 0, which does nothing) on track 0 of the
+    slot each way, and returns the events per second of both. Events beyond
+    the capacity of SunVox's event queue are not sent, so the number actually
+    sent is returned too.
+    """
+    notes = np.zeros(count, NOTE_DTYPE)
+    # Allocates the heap buffer and compiles the JS loop outside the timing.
+    SunVoxApi.send_events(slot, 0, notes)
+    started = time.perf_counter()
+    per_event_sent = 0
+    for note in notes.tolist():
+        per_event_sent += SunVoxApi.send_event(slot, 0, *note) == 0
+    per_event = time.perf_counter() - started
+    started = time.perf_counter()
+    batched_sent = SunVoxApi.send_events(slot, 0, notes)
+    batched = time.perf_counter() - started
+    results = {
+        "events": count,
+        "per_event_sent": per_event_sent,
+        "batched_sent": batched_sent,
+        "per_event_per_second": count / per_event,
+        "batched_per_second": count / batched,
+        "speedup": per_event / batched,
+    }
+    console.log(repr(results))
+    return results
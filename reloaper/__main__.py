@@ -1,35 +1,131 @@
 import asyncio
 import logging
 from pathlib import Path
+from typing import Optional
 
+import numpy as np
 import typer
 from rich.logging import RichHandler
 
-import sunvox.api
-from reloaper.pubsub import hub, Key, message_logger
+from reloaper.daemon import PipelineFactory
+from reloaper.engine import init_sunvox
+from reloaper.export import check_export_format
+from reloaper.metrics import MetricsFormat, MetricsWriter
+from reloaper.parallel import ParallelRenderer
+from reloaper.loopregion import LOOP_CHANGED, LoopChanged
+from reloaper.playback import Playback
+from reloaper.preview import PreviewRenderer
+from reloaper.pubsub import init_hub_logging
+from reloaper.rendercache import DEFAULT_MAX_BYTES, RenderCache, default_cache_dir
+from reloaper.scheduler import RenderScheduler, is_song_pattern
+from reloaper.songloader import SongLoader
 from reloaper.songmapper import SongMapper
 from reloaper.songrenderer import SongRenderer
-from reloaper.songwatcher import SongWatcher
+from reloaper.songwatcher import SongDirectoryWatcher, SongWatcher
 
 log = logging.getLogger(__name__)
 
 
-def entrypoint(song_path: Path, freq: int = 44100):
-    song_path = song_path.resolve()
-    init_logging()
-    init_sunvox(freq=freq)
+def entrypoint(
+    song_path: Path,
+    freq: int = 44100,
+    float32: bool = False,
+    chunk_size: int = 4096,
+    workers: int = 1,
+    warmup_lines: int = 64,
+    verify_seams: bool = False,
+    preroll_lines: int = 16,
+    debounce_ms: int = 200,
+    classify: bool = True,
+    play: bool = False,
+    loop_start: Optional[int] = None,
+    loop_length: Optional[int] = None,
+    cache: bool = True,
+    cache_dir: Optional[Path] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    export: Optional[Path] = None,
+    metrics_file: Optional[Path] = None,
+    metrics_format: MetricsFormat = MetricsFormat.jsonl,
+    max_renders: Optional[int] = None,
+    preview_freq: Optional[int] = None,
+    verbose: bool = False,
+):
+    if export is not None:
+        # Checked up front; otherwise the export fails once rendering starts.
+        try:
+            check_export_format(export.suffix.lstrip("."))
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--export")
+    render_cache = (
+        RenderCache(root=cache_dir or default_cache_dir(), max_bytes=cache_max_bytes)
+        if cache
+        else None
+    )
+    dtype = np.float32 if float32 else np.int16
+    parallel = (
+        ParallelRenderer(
+            freq=freq,
+            workers=workers,
+            dtype=dtype,
+            chunk_size=chunk_size,
+            warmup_lines=warmup_lines,
+            verify_seams=verify_seams,
+        )
+        if workers > 1
+        else None
+    )
+    preview = (
+        PreviewRenderer(freq=preview_freq, dtype=dtype)
+        if preview_freq is not None and export is None
+        else None
+    )
+    init_logging(verbose)
+    init_sunvox(freq=freq, float32=float32)
     init_hub_logging()
-    asyncio.run(main(song_path=song_path))
-
-
-def init_hub_logging():
-    hub.add_subscriber(Key("*"), message_logger)
+    if metrics_file is not None:
+        MetricsWriter(path=metrics_file, format=metrics_format)
+    if is_song_pattern(str(song_path)):
+        if play or export:
+            log.warning("--play and --export only apply to a single song")
+        asyncio.run(
+            main_many(
+                song_pattern=str(song_path),
+                preroll_lines=preroll_lines,
+                debounce_ms=debounce_ms,
+                classify=classify,
+                freq=freq,
+                dtype=dtype,
+                chunk_size=chunk_size,
+                parallel=parallel,
+                render_cache=render_cache,
+                max_renders=max_renders or workers,
+            )
+        )
+        return
+    asyncio.run(
+        main(
+            song_path=song_path.resolve(),
+            preroll_lines=preroll_lines,
+            debounce_ms=debounce_ms,
+            classify=classify,
+            freq=freq,
+            dtype=dtype,
+            chunk_size=chunk_size,
+            parallel=parallel,
+            play=play,
+            loop_start=loop_start,
+            loop_length=loop_length,
+            render_cache=render_cache,
+            export_path=export.resolve() if export else None,
+            preview=preview,
+        )
+    )
 
 
-def init_logging():
+def init_logging(verbose: bool = False):
     FORMAT = "%(message)s"
     logging.basicConfig(
-        level=logging.NOTSET,
+        level=logging.DEBUG if verbose else logging.INFO,
         format=FORMAT,
         datefmt="[%X]",
         handlers=[RichHandler()],
@@ -37,21 +133,101 @@ def init_logging():
     log.debug("Logging initialized")
 
 
-def init_sunvox(*, freq: int):
-    flags = sunvox.api.INIT_FLAG.USER_AUDIO_CALLBACK | sunvox.api.INIT_FLAG.ONE_THREAD
-    sunvox.api.init(None, freq, 2, flags)
-    log.debug("Initialized SunVox library")
-
-
-async def main(*, song_path: Path):
-    song_watcher = SongWatcher(song_path=song_path)
+async def main(
+    *,
+    song_path: Path,
+    preroll_lines: int,
+    debounce_ms: int,
+    classify: bool,
+    freq: int,
+    dtype: type,
+    chunk_size: int,
+    parallel: ParallelRenderer | None,
+    play: bool,
+    loop_start: int | None,
+    loop_length: int | None,
+    render_cache: RenderCache | None,
+    export_path: Path | None,
+    preview: PreviewRenderer | None,
+):
+    song_watcher = SongWatcher(
+        song_path=song_path,
+        debounce_ms=debounce_ms,
+        classify=classify,
+    )
+    song_loader = SongLoader(song_path=song_path)
     song_mapper = SongMapper(song_path=song_path)
-    song_renderer = SongRenderer(song_path=song_path)
-    await asyncio.gather(
+    song_renderer = SongRenderer(
+        song_path=song_path,
+        freq=freq,
+        dtype=dtype,
+        chunk_size=chunk_size,
+        preroll_lines=preroll_lines,
+        parallel=parallel,
+        cache=render_cache,
+        export_path=export_path,
+        preview=preview,
+    )
+    tasks = [
         song_watcher.watch(),
+        song_loader.load_loop(),
         song_mapper.render_loop(),
         song_renderer.render_loop(),
+    ]
+    if play:
+        # Without --play no audio device is opened, so renders work headless.
+        playback = Playback(song_path=song_path, freq=freq, dtype=dtype)
+        playback.play()
+        tasks.append(playback.run())
+    if loop_start is not None and loop_length:
+        LOOP_CHANGED.publish(
+            LoopChanged(start_line=loop_start, length_lines=loop_length)
+        )
+    await asyncio.gather(*tasks)
+
+
+async def main_many(
+    *,
+    song_pattern: str,
+    preroll_lines: int,
+    debounce_ms: int,
+    classify: bool,
+    freq: int,
+    dtype: type,
+    chunk_size: int,
+    parallel: ParallelRenderer | None,
+    render_cache: RenderCache | None,
+    max_renders: int,
+):
+    factory = PipelineFactory(
+        freq=freq,
+        dtype=dtype,
+        chunk_size=chunk_size,
+        preroll_lines=preroll_lines,
+        debounce_ms=debounce_ms,
+        classify=classify,
+        cache=render_cache,
+        parallel=parallel,
+        # Parallel renders run in the worker processes, up to max_renders at
+        # once.
+        parallel_scheduler=RenderScheduler(max_renders=max_renders),
     )
+    # Holds on to every pipeline, and with it the tasks it runs.
+    pipelines = {}
+
+    def start_pipeline(song_path: Path) -> SongWatcher:
+        # One directory watch covers every song, so the song's own watcher
+        # does not watch it again.
+        pipeline = factory.create(song_path, watch_directory=False)
+        pipeline.start()
+        pipelines[song_path] = pipeline
+        return pipeline.watcher
+
+    await SongDirectoryWatcher(
+        pattern=song_pattern,
+        add_song=start_pipeline,
+        debounce_ms=debounce_ms,
+    ).watch()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import numpy as np
+
+from reloaper.timemap import TimeMap
+
+# Frames compared per pass, so the temporary comparison arrays stay small no
+# matter how long the song is.
+SLAB_FRAMES = 1 << 20
+
+
+def changed_blocks(
+    old: np.ndarray,
+    new: np.ndarray,
+    block_frames: int,
+    start_frame: int = 0,
+) -> np.ndarray:
+    """Flag each block of `block_frames` frames where `old` and `new` differ.
+
+    Only the frames both arrays have are compared. Blocks before the one
+    holding `start_frame` are known to be identical and are not read.
+    """
+    common = min(len(old), len(new))
+    blocks = -(-common // block_frames)
+    changed = np.zeros(blocks, bool)
+    first_block = min(start_frame, common) // block_frames
+    slab_blocks = max(SLAB_FRAMES // block_frames, 1)
+    for block in range(first_block, blocks, slab_blocks):
+        begin = block * block_frames
+        end = min((block + slab_blocks) * block_frames, common)
+        full_end = begin + (end - begin) // block_frames * block_frames
+        count = (full_end - begin) // block_frames
+        if count:
+            differs = old[begin:full_end] != new[begin:full_end]
+            changed[block : block + count] = differs.reshape(count, -1).any(axis=1)
+        if full_end < end:
+            changed[block + count] = np.any(old[full_end:end] != new[full_end:end])
+    return changed
+
+
+def changed_frame_ranges(
+    old: np.ndarray,
+    new: np.ndarray,
+    block_frames: int = 1024,
+    start_frame: int = 0,
+) -> np.ndarray:
+    """Return an (n, 2) array of [start, end) frame ranges where audio changed.
+
+    Ranges are block-aligned and given in frames of `new`. If the song changed
+    length, the frames past the shorter of the two count as changed.
+    """
+    changed = changed_blocks(old, new, block_frames, start_frame)
+    common = min(len(old), len(new))
+    edges = np.flatnonzero(np.diff(changed, prepend=False, append=False))
+    ranges = edges.reshape(-1, 2) * block_frames
+    np.minimum(ranges, common, out=ranges)
+    if len(old) != len(new):
+        tail = np.array([[common, max(len(old), len(new))]])
+        if len(ranges) and ranges[-1, 1] == common:
+            ranges[-1, 1] = tail[0, 1]
+        else:
+            ranges = np.concatenate([ranges, tail])
+    return ranges.astype(np.int64)
+
+
+def frame_ranges_to_lines(frame_ranges: np.ndarray, time_map: TimeMap) -> np.ndarray:
+    """Convert [start, end) frame ranges to [start, end) line ranges."""
+    if not len(frame_ranges):
+        return np.zeros((0, 2), np.int64)
+    starts = time_map.frame_lines(frame_ranges[:, 0])
+    ends = time_map.frame_lines(frame_ranges[:, 1] - 1) + 1
+    return np.stack([starts, ends], axis=1).astype(np.int64)
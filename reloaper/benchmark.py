@@ -0,0 +1,301 @@
+"""Render benchmark for reloaper.
+
+Builds synthetic songs of controlled size with Radiant Voices, runs them
+through the SongMapper and SongRenderer code paths, and records one JSON object
+per song in a JSON Lines file that can be compared against a baseline run.
+Each song is benchmarked in a fresh process, so its memory figures are not
+inflated by the songs before it:
+
+    python -m reloaper.benchmark --output bench.jsonl
+    python -m reloaper.benchmark --output new.jsonl --baseline bench.jsonl
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import multiprocessing
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import attrs
+import numpy as np
+import typer
+from rv.api import Note, Pattern, Project, m
+
+import sunvox.api
+from reloaper.metrics import metrics_dict, render_metrics, reset_peak_memory
+from reloaper.parallel import init_worker
+from reloaper.songmapper import map_song
+from reloaper.songrenderer import SongRenderer
+
+log = logging.getLogger(__name__)
+
+
+@attrs.frozen
+class SongSpec:
+    lines: int
+    patterns: int
+    modules: int
+    tracks: int = 4
+
+    @property
+    def name(self) -> str:
+        return f"l{self.lines}-p{self.patterns}-m{self.modules}-t{self.tracks}"
+
+
+DEFAULT_SPECS = [
+    SongSpec(lines=1024, patterns=4, modules=1),
+    SongSpec(lines=1024, patterns=4, modules=8),
+    SongSpec(lines=4096, patterns=16, modules=1),
+    SongSpec(lines=4096, patterns=16, modules=8),
+    SongSpec(lines=16384, patterns=64, modules=8),
+    SongSpec(lines=16384, patterns=64, modules=32),
+]
+
+
+def synthetic_song(spec: SongSpec, seed: int = 0) -> Project:
+    rng = np.random.default_rng(seed)
+    project = Project()
+    project.name = spec.name
+    generators = []
+    for index in range(spec.modules):
+        generator = project.new_module(
+            m.AnalogGenerator,
+            x=128 + (index % 8) * 96,
+            y=128 + (index // 8) * 96,
+        )
+        project.connect(generator, project.output)
+        generators.append(generator)
+    pattern_lines = max(spec.lines // spec.patterns, 1)
+    for pattern_index in range(spec.patterns):
+        pattern = Pattern(
+            lines=pattern_lines,
+            tracks=spec.tracks,
+            x=pattern_index * pattern_lines,
+        )
+        project.attach_pattern(pattern)
+        notes = rng.integers(37, 85, size=(pattern_lines, spec.tracks))
+        modules = rng.integers(0, spec.modules, size=(pattern_lines, spec.tracks))
+        for line in range(0, pattern_lines, 2):
+            for track in range(spec.tracks):
+                pattern.data[line][track] = Note(
+                    note=int(notes[line, track]),
+                    module=generators[modules[line, track]].index + 1,
+                    pattern=pattern,
+                )
+    return project
+
+
+async def benchmark_song(
+    song_path: Path,
+    spec: SongSpec,
+    *,
+    freq: int,
+    dtype: np.dtype,
+    chunk_size: int,
+) -> dict:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    with sunvox.api.Slot(song_path) as slot:
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        time_map, _ = map_song(slot)
+        map_seconds = time.perf_counter() - started
+        renderer = SongRenderer(
+            song_path=song_path,
+            freq=freq,
+            dtype=dtype,
+            chunk_size=chunk_size,
+        )
+        try:
+            reset_peak_memory()
+            started = time.perf_counter()
+            audio, frames_rendered = await loop.run_in_executor(
+                renderer.executor,
+                renderer.render,
+                slot,
+                time_map,
+                0,
+                None,
+                loop,
+            )
+            render_seconds = time.perf_counter() - started
+            metrics = render_metrics(
+                song_path=song_path,
+                content_hash="",
+                freq=freq,
+                load_seconds=load_seconds,
+                map_seconds=map_seconds,
+                render_seconds=render_seconds,
+                frames_rendered=frames_rendered,
+                song_length_frames=len(audio),
+            )
+            audio_bytes = audio.nbytes
+            renderer.pool.release(audio)
+        finally:
+            renderer.close()
+            renderer.executor.shutdown()
+            renderer.parallel_executor.shutdown()
+    result = metrics_dict(metrics)
+    del result["song_path"], result["content_hash"]
+    result.update(
+        spec=spec.name,
+        song_lines=spec.lines,
+        song_patterns=spec.patterns,
+        song_modules=spec.modules,
+        audio_bytes=audio_bytes,
+        bytes_per_line=audio_bytes / max(spec.lines, 1),
+    )
+    return result
+
+
+def benchmark_spec(
+    song_path: Path,
+    spec: SongSpec,
+    *,
+    freq: int,
+    dtype: np.dtype,
+    chunk_size: int,
+    repeat: int,
+) -> list[dict]:
+    # Runs in a process of its own, started for this song.
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    results = []
+    for run in range(repeat):
+        result = asyncio.run(
+            benchmark_song(
+                song_path,
+                spec,
+                freq=freq,
+                dtype=dtype,
+                chunk_size=chunk_size,
+            )
+        )
+        result["run"] = run
+        log.info(
+            "%s run %d: %.0f frames/s, %.1fx real time, %.3fs render",
+            spec.name,
+            run,
+            result["frames_per_second"],
+            result["realtime_factor"],
+            result["render_seconds"],
+        )
+        results.append(result)
+    return results
+
+
+async def run_benchmark(
+    specs: list[SongSpec],
+    *,
+    freq: int,
+    dtype: np.dtype,
+    chunk_size: int,
+    repeat: int,
+) -> list[dict]:
+    loop = asyncio.get_running_loop()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="reloaper-bench-") as tmp:
+        for spec in specs:
+            song_path = Path(tmp) / f"{spec.name}.sunvox"
+            with song_path.open("wb") as f:
+                synthetic_song(spec).write_to(f)
+            with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(freq, dtype == np.float32),
+            ) as executor:
+                results.extend(
+                    await loop.run_in_executor(
+                        executor,
+                        functools.partial(
+                            benchmark_spec,
+                            song_path,
+                            spec,
+                            freq=freq,
+                            dtype=dtype,
+                            chunk_size=chunk_size,
+                            repeat=repeat,
+                        ),
+                    )
+                )
+    return results
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "timestamp": time.time(),
+    }
+
+
+def best_by_spec(results: list[dict]) -> dict[str, dict]:
+    best = {}
+    for result in results:
+        spec = result.get("spec")
+        if spec is None:
+            continue
+        if spec not in best or result["render_seconds"] < best[spec]["render_seconds"]:
+            best[spec] = result
+    return best
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    current = best_by_spec(results)
+    previous = best_by_spec(baseline)
+    for spec, result in current.items():
+        if spec not in previous:
+            log.info("%s: no baseline", spec)
+            continue
+        ratio = result["frames_per_second"] / previous[spec]["frames_per_second"]
+        log.info(
+            "%s: %.0f frames/s vs %.0f baseline (%+.1f%%)",
+            spec,
+            result["frames_per_second"],
+            previous[spec]["frames_per_second"],
+            (ratio - 1) * 100,
+        )
+
+
+def read_results(path: Path) -> list[dict]:
+    with path.open() as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def entrypoint(
+    output: Path = Path("bench_output.jsonl"),
+    baseline: Optional[Path] = None,
+    freq: int = 44100,
+    float32: bool = False,
+    chunk_size: int = 4096,
+    repeat: int = 3,
+):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    results = asyncio.run(
+        run_benchmark(
+            DEFAULT_SPECS,
+            freq=freq,
+            dtype=np.dtype(np.float32 if float32 else np.int16),
+            chunk_size=chunk_size,
+            repeat=repeat,
+        )
+    )
+    with output.open("w") as f:
+        f.write(json.dumps({"environment": environment()}) + "\n")
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    log.info("Wrote %d results to %s", len(results), output)
+    if baseline is not None:
+        compare(results, read_results(baseline))
+
+
+if __name__ == "__main__":
+    typer.run(entrypoint)
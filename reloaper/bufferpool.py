@@ -0,0 +1,109 @@
+import functools
+import logging
+import threading
+import weakref
+
+import attrs
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def size_class(length: int) -> int:
+    """Round `length` up to the next of 4, 5, 6 or 7 times a power of two.
+
+    Classes are at most 25% larger than what was asked for, so a song that
+    grows or shrinks a little between saves still fits its old buffer.
+    """
+    if length <= 4:
+        return 4
+    shift = length.bit_length() - 3
+    step = 1 << shift
+    return -(-length // step) * step
+
+
+@attrs.define
+class BufferPool:
+    """Reusable, size-classed NumPy buffers for time maps and render audio.
+
+    `acquire` returns an array with one reference; every other holder calls
+    `retain` when it takes the array and `release` when it is done with it.
+    Once the last reference is released the buffer goes back to the pool, and
+    the next acquire of the same size class and dtype reuses it instead of
+    allocating and page-faulting a new one.
+
+    Arrays that did not come from the pool, such as memory-mapped cache
+    entries, can be passed to `retain` and `release` and are ignored, and so
+    can objects backed by a pooled array, such as a TimeMap. The pool
+    only holds weak references to lent buffers, so one that is dropped without
+    being released is garbage collected as usual.
+    """
+
+    max_idle: int = 2
+
+    free: dict[tuple, list[np.ndarray]] = attrs.field(factory=dict)
+    lent: dict[int, list] = attrs.field(factory=dict)
+    lock: threading.Lock = attrs.field(factory=threading.Lock)
+
+    def acquire(self, shape: tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        length, *tail = shape
+        key = (size_class(length), dtype, tuple(tail))
+        with self.lock:
+            buffers = self.free.get(key)
+            if buffers:
+                base = buffers.pop()
+            else:
+                log.debug("Allocating a %r buffer", key)
+                base = np.empty((key[0], *tail), dtype)
+            forget = functools.partial(self.forget, id(base))
+            self.lent[id(base)] = [weakref.ref(base, forget), key, 1]
+        return base[:length]
+
+    def retain(self, array):
+        with self.lock:
+            entry = self.entry(array)
+            if entry is not None:
+                entry[2] += 1
+        return array
+
+    def release(self, array):
+        with self.lock:
+            entry = self.entry(array)
+            if entry is None:
+                return
+            entry[2] -= 1
+            if entry[2]:
+                return
+            ref, key, _ = self.lent.pop(id(array_base(array)))
+            buffers = self.free.setdefault(key, [])
+            if len(buffers) < self.max_idle:
+                buffers.append(ref())
+
+    def entry(self, array) -> list | None:
+        base = array_base(array)
+        entry = self.lent.get(id(base))
+        if entry is None or entry[0]() is not base:
+            return None
+        return entry
+
+    def forget(self, base_id: int, ref: weakref.ref):
+        # Called when a lent buffer is garbage collected without having been
+        # released. Its id cannot have been reused yet, so no lock is needed.
+        entry = self.lent.get(base_id)
+        if entry is not None and entry[0] is ref:
+            del self.lent[base_id]
+
+
+def array_base(array) -> np.ndarray | None:
+    """The array that owns the memory of `array`, or `array` itself."""
+    # Objects backed by an array, like TimeMap, keep it in `buffer`.
+    array = getattr(array, "buffer", array)
+    while array is not None and isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+# Shared by every pipeline stage by default, since a buffer is usually
+# acquired by one stage and released last by another.
+shared_pool = BufferPool()
@@ -0,0 +1,321 @@
+"""Long-running reloaper process controlled over a local Unix socket.
+
+SunVox is initialized once and any number of songs can be watched and
+rendered without paying the startup cost again:
+
+    python -m reloaper.daemon serve &
+    python -m reloaper.daemon send watch song.sunvox
+    python -m reloaper.daemon send status
+
+Each request and response is one line of JSON. Requests have a "command" and,
+for commands that act on a song, a "song" path.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import attrs
+import numpy as np
+import typer
+
+from reloaper.engine import init_sunvox
+from reloaper.parallel import ParallelRenderer
+from reloaper.pubsub import Subscription
+from reloaper.rendercache import DEFAULT_MAX_BYTES, RenderCache, default_cache_dir
+from reloaper.scheduler import RenderScheduler
+from reloaper.songloader import SlotPool, SongLoader
+from reloaper.songmapper import SongMapper
+from reloaper.songrenderer import RENDER_PROGRESS, RenderProgress, SongRenderer
+from reloaper.songwatcher import SongWatcher
+
+log = logging.getLogger(__name__)
+
+app = typer.Typer()
+
+
+def default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "reloaper.sock"
+    return Path(tempfile.gettempdir()) / f"reloaper-{os.getuid()}.sock"
+
+
+class CommandError(Exception):
+    pass
+
+
+@attrs.define
+class SongPipeline:
+    """The stages that watch, load, map and render one song."""
+
+    watcher: SongWatcher
+    loader: SongLoader
+    mapper: SongMapper
+    renderer: SongRenderer
+    tasks: list[asyncio.Task] = attrs.field(factory=list)
+    render_task: asyncio.Task | None = None
+    progress: RenderProgress | None = None
+    error: str | None = None
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.watcher.watch()),
+            asyncio.create_task(self.loader.load_loop()),
+            asyncio.create_task(self.mapper.render_loop()),
+        ]
+        self.render_task = asyncio.create_task(self.renderer.render_loop())
+        # Nothing awaits the tasks, so a stage that fails is reported here.
+        for task in (*self.tasks, self.render_task):
+            task.add_done_callback(self.task_done)
+
+    def task_done(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        log.error(
+            "Pipeline for %s stopped",
+            self.watcher.song_path,
+            exc_info=task.exception(),
+        )
+        self.error = repr(task.exception())
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.loader.close()
+        self.mapper.close()
+        self.renderer.close()
+        # A render in progress is still using its slot, so it has to reach the
+        # next chunk boundary and stop before the render loop is cancelled.
+        while self.renderer.rendering:
+            await asyncio.sleep(0.01)
+        self.render_task.cancel()
+
+    def status(self) -> dict:
+        renderer = self.renderer
+        audio = renderer.latest_audio
+        return {
+            "song": str(self.watcher.song_path),
+            "rendering": renderer.rendering,
+            "content_hash": renderer.latest_hash,
+            "frames": None if audio is None else len(audio),
+            "frames_rendered": self.progress and self.progress.frames_rendered,
+            "frames_total": self.progress and self.progress.frames_total,
+            "error": self.error,
+        }
+
+
+@attrs.define
+class PipelineFactory:
+    """Builds the pipelines of songs rendered side by side.
+
+    Every pipeline gets a slot while its song is loaded, and songs wait for
+    one of SunVox's slots to be free. In-process renders share one thread,
+    since SunVox mixes all playing slots into one audio callback, so only one
+    is let through at a time and the most recently edited song goes next.
+    Parallel renders run in worker processes and take their permits from
+    `parallel_scheduler` instead, when given.
+    """
+
+    freq: int = 44100
+    dtype: np.dtype = attrs.field(default=np.dtype(np.int16), converter=np.dtype)
+    chunk_size: int = 4096
+    preroll_lines: int = 16
+    debounce_ms: int = 200
+    classify: bool = True
+    cache: RenderCache | None = None
+    parallel: ParallelRenderer | None = None
+
+    slots: SlotPool = attrs.field(factory=SlotPool)
+    executor: ThreadPoolExecutor = attrs.field(
+        factory=lambda: ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="SongRenderer",
+        )
+    )
+    scheduler: RenderScheduler = attrs.field(
+        factory=lambda: RenderScheduler(max_renders=1)
+    )
+    parallel_scheduler: RenderScheduler | None = None
+
+    def create(self, song_path: Path, watch_directory: bool = True) -> SongPipeline:
+        return SongPipeline(
+            watcher=SongWatcher(
+                song_path=song_path,
+                debounce_ms=self.debounce_ms,
+                classify=self.classify,
+                watch_directory=watch_directory,
+            ),
+            loader=SongLoader(song_path=song_path, slots=self.slots),
+            mapper=SongMapper(song_path=song_path),
+            renderer=SongRenderer(
+                song_path=song_path,
+                freq=self.freq,
+                dtype=self.dtype,
+                chunk_size=self.chunk_size,
+                preroll_lines=self.preroll_lines,
+                parallel=self.parallel,
+                cache=self.cache,
+                executor=self.executor,
+                scheduler=self.scheduler,
+                parallel_scheduler=self.parallel_scheduler,
+            ),
+        )
+
+
+@attrs.define
+class Daemon:
+    factory: PipelineFactory = attrs.field(factory=PipelineFactory)
+
+    pipelines: dict[Path, SongPipeline] = attrs.field(factory=dict)
+
+    # Only the latest progress of each song is shown, so if the daemon falls
+    # behind, older updates are dropped rather than queued without bound.
+    progress: Subscription[RenderProgress] = attrs.field(
+        factory=lambda: RENDER_PROGRESS.queue(maxsize=64)
+    )
+
+    async def serve(self, socket_path: Path):
+        socket_path.unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(self.handle_client, socket_path)
+        log.info("Listening on %s", socket_path)
+        progress_task = asyncio.create_task(self.track_progress())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            progress_task.cancel()
+            self.progress.close()
+            for pipeline in self.pipelines.values():
+                await pipeline.close()
+            socket_path.unlink(missing_ok=True)
+
+    async def handle_client(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    response = {"ok": True, **(await self.handle(request))}
+                except (CommandError, ValueError, KeyError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle(self, request: dict) -> dict:
+        if not isinstance(request, dict):
+            raise CommandError("request must be a JSON object")
+        command = request["command"]
+        if command == "status":
+            return {"songs": [p.status() for p in self.pipelines.values()]}
+        if "song" not in request:
+            raise CommandError(f"{command!r} requires a song")
+        song_path = Path(request["song"]).resolve()
+        if command == "watch":
+            return self.watch(song_path)
+        if command == "unwatch":
+            return await self.unwatch(song_path)
+        if command == "render":
+            return self.render(song_path)
+        raise CommandError(f"Unknown command {command!r}")
+
+    def watch(self, song_path: Path) -> dict:
+        if song_path not in self.pipelines:
+            pipeline = self.factory.create(song_path)
+            pipeline.start()
+            self.pipelines[song_path] = pipeline
+            log.info("Watching %s", song_path)
+        return self.pipelines[song_path].status()
+
+    async def unwatch(self, song_path: Path) -> dict:
+        pipeline = self.pipelines.pop(song_path, None)
+        if pipeline is None:
+            raise CommandError(f"{song_path} is not being watched")
+        await pipeline.close()
+        log.info("Stopped watching %s", song_path)
+        return {"song": str(song_path)}
+
+    def render(self, song_path: Path) -> dict:
+        pipeline = self.pipelines.get(song_path)
+        if pipeline is None:
+            raise CommandError(f"{song_path} is not being watched")
+        # Forget what was rendered so the current file goes through the whole
+        # pipeline again, without waiting for it to be saved.
+        pipeline.watcher.latest_hash = None
+        pipeline.renderer.latest_hash = None
+        pipeline.renderer.latest_signature = None
+        pipeline.watcher.publish_change()
+        return pipeline.status()
+
+    async def track_progress(self):
+        async for message in self.progress:
+            pipeline = self.pipelines.get(message.song_path)
+            if pipeline is not None:
+                pipeline.progress = message
+
+
+async def send_command(socket_path: Path, request: dict) -> dict:
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+
+@app.command()
+def serve(
+    socket: Optional[Path] = None,
+    freq: int = 44100,
+    float32: bool = False,
+    chunk_size: int = 4096,
+    preroll_lines: int = 16,
+    debounce_ms: int = 200,
+    cache: bool = True,
+    cache_dir: Optional[Path] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    init_sunvox(freq=freq, float32=float32)
+    root = cache_dir or default_cache_dir()
+    daemon = Daemon(
+        factory=PipelineFactory(
+            freq=freq,
+            dtype=np.float32 if float32 else np.int16,
+            chunk_size=chunk_size,
+            preroll_lines=preroll_lines,
+            debounce_ms=debounce_ms,
+            cache=RenderCache(root=root, max_bytes=cache_max_bytes) if cache else None,
+        )
+    )
+    asyncio.run(daemon.serve(socket or default_socket_path()))
+
+
+@app.command()
+def send(
+    command: str,
+    song: Optional[Path] = typer.Argument(None),
+    socket: Optional[Path] = None,
+):
+    request = {"command": command}
+    if song is not None:
+        request["song"] = str(song.resolve())
+    response = asyncio.run(send_command(socket or default_socket_path(), request))
+    typer.echo(json.dumps(response, indent=2))
+    if not response.get("ok"):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,51 @@
+import ctypes
+import logging
+
+import numpy as np
+
+import sunvox.api
+
+log = logging.getLogger(__name__)
+
+
+def init_sunvox(*, freq: int, float32: bool = False):
+    flags = sunvox.api.INIT_FLAG.USER_AUDIO_CALLBACK | sunvox.api.INIT_FLAG.ONE_THREAD
+    if float32:
+        flags |= sunvox.api.INIT_FLAG.AUDIO_FLOAT32
+    sunvox.api.init(None, freq, 2, flags)
+    log.debug("Initialized SunVox library")
+
+
+def play_from(slot: sunvox.api.Slot, line: int):
+    # The first stop() halts playback; the second resets every module,
+    # so tails from a previous render cannot leak into this one.
+    slot.stop()
+    slot.stop()
+    slot.rewind(line)
+    slot.play()
+
+
+def render_chunks(dest: np.ndarray, chunk_size: int):
+    """Fill `dest` from the SunVox output, one chunk at a time.
+
+    Each chunk is rendered straight into its slice of `dest`; rows of a
+    (frames, 2) array are contiguous, so even the final short chunk needs no
+    copy. Yields the number of frames rendered so far after every chunk.
+    """
+    pointer_type = ctypes.POINTER(np.ctypeslib.as_ctypes_type(dest.dtype))
+    frames = len(dest)
+    current_frame = 0
+    while current_frame < frames:
+        end_frame = min(current_frame + chunk_size, frames)
+        sunvox.api.audio_callback(
+            dest[current_frame:end_frame].ctypes.data_as(pointer_type),
+            end_frame - current_frame,
+            0,
+            sunvox.api.get_ticks(),
+        )
+        current_frame = end_frame
+        yield current_frame
+
+
+class RenderCancelled(Exception):
+    pass
@@ -0,0 +1,157 @@
+"""Streaming export of a SunVox song to a WAV or FLAC file.
+
+Audio is rendered one chunk at a time into a single reusable buffer and
+written straight to disk, so memory use does not grow with song length:
+
+    python -m reloaper.export song.sunvox song.flac
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import wave
+from pathlib import Path
+
+import numpy as np
+import typer
+
+import sunvox.api
+from reloaper.engine import RenderCancelled, init_sunvox, play_from, render_chunks
+
+try:
+    import soundfile
+except ImportError:
+    # Only needed for FLAC and float WAV; 16-bit WAV uses the wave module.
+    soundfile = None
+
+log = logging.getLogger(__name__)
+
+INT16_SCALE = 32767
+
+
+class WaveWriter:
+    """16-bit PCM WAV writer built on the standard library."""
+
+    def __init__(self, path: Path, freq: int):
+        self.file = wave.open(str(path), "wb")
+        self.file.setnchannels(2)
+        self.file.setsampwidth(2)
+        self.file.setframerate(freq)
+
+    def write(self, chunk: np.ndarray):
+        if chunk.dtype != np.int16:
+            chunk = (np.clip(chunk, -1.0, 1.0) * INT16_SCALE).astype(np.int16)
+        self.file.writeframes(chunk)
+
+    def close(self):
+        self.file.close()
+
+
+EXPORT_FORMATS = ("wav", "flac")
+
+
+def check_export_format(audio_format: str):
+    """Raise ValueError if files of `audio_format` cannot be written."""
+    audio_format = audio_format.lower()
+    if audio_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unsupported export format {audio_format!r}; use .wav or .flac"
+        )
+    if audio_format == "flac" and soundfile is None:
+        raise ValueError("FLAC export requires the soundfile package")
+
+
+def open_audio_file(path: Path, audio_format: str, freq: int, dtype: np.dtype):
+    check_export_format(audio_format)
+    audio_format = audio_format.lower()
+    if audio_format == "wav" and (dtype != np.float32 or soundfile is None):
+        if dtype == np.float32:
+            log.warning(
+                "soundfile is not installed, so float audio is written to %s "
+                "as 16-bit PCM",
+                path,
+            )
+        return WaveWriter(path, freq)
+    if audio_format == "flac":
+        subtype = "PCM_24" if dtype == np.float32 else "PCM_16"
+    else:
+        subtype = "FLOAT"
+    return soundfile.SoundFile(
+        path,
+        mode="w",
+        samplerate=freq,
+        channels=2,
+        format=audio_format.upper(),
+        subtype=subtype,
+    )
+
+
+def export_song(
+    slot: sunvox.api.Slot,
+    path: Path,
+    *,
+    freq: int,
+    dtype: np.dtype,
+    chunk_size: int = 4096,
+    cancel_event: threading.Event | None = None,
+) -> int:
+    """Render the whole song in `slot` to `path`; returns the frames written.
+
+    The file is written next to `path` and renamed into place when complete,
+    so a reader never sees a partial export.
+    """
+    song_length_frames = slot.get_song_length_frames()
+    buffer = np.ndarray((chunk_size, 2), dtype)
+    partial = path.with_name(f".{path.name}.partial")
+    audio_format = path.suffix.lstrip(".")
+    log.debug("Exporting %r frames to %r...", song_length_frames, path)
+    try:
+        with contextlib.closing(
+            open_audio_file(partial, audio_format, freq, np.dtype(dtype))
+        ) as writer:
+            play_from(slot, 0)
+            try:
+                written = 0
+                while written < song_length_frames:
+                    frames = min(chunk_size, song_length_frames - written)
+                    for _ in render_chunks(buffer[:frames], chunk_size):
+                        pass
+                    writer.write(buffer[:frames])
+                    written += frames
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise RenderCancelled()
+            finally:
+                slot.stop()
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+    return song_length_frames
+
+
+def entrypoint(
+    song_path: Path,
+    output_path: Path,
+    freq: int = 44100,
+    float32: bool = False,
+    chunk_size: int = 4096,
+):
+    try:
+        check_export_format(output_path.suffix.lstrip("."))
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint="OUTPUT_PATH")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    init_sunvox(freq=freq, float32=float32)
+    with sunvox.api.Slot(song_path.resolve()) as slot:
+        frames = export_song(
+            slot,
+            output_path,
+            freq=freq,
+            dtype=np.dtype(np.float32 if float32 else np.int16),
+            chunk_size=chunk_size,
+        )
+    log.info("Wrote %d frames to %s", frames, output_path)
+
+
+if __name__ == "__main__":
+    typer.run(entrypoint)
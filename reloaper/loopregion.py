@@ -0,0 +1,12 @@
+import attrs
+
+from reloaper.pubsub import Key, Topic
+
+
+@attrs.define
+class LoopChanged:
+    start_line: int | None
+    length_lines: int | None
+
+
+LOOP_CHANGED = Topic(Key("loop", "changed"), LoopChanged)
@@ -0,0 +1,142 @@
+import contextlib
+import json
+import logging
+import os
+import resource
+import sys
+from collections.abc import Iterable
+from enum import Enum
+from pathlib import Path
+
+import attrs
+
+from reloaper.pubsub import Key, Topic
+
+log = logging.getLogger(__name__)
+
+
+class MetricsFormat(str, Enum):
+    jsonl = "jsonl"
+    prometheus = "prometheus"
+
+
+@attrs.define
+class RenderMetrics:
+    song_path: Path
+    content_hash: str
+    load_seconds: float
+    map_seconds: float
+    render_seconds: float
+    frames_rendered: int
+    song_length_frames: int
+    frames_per_second: float
+    realtime_factor: float
+    # Peak resident memory of the process since reset_peak_memory was called
+    # before the render. Where the peak cannot be reset, it is the peak since
+    # the process started.
+    peak_memory_bytes: int
+
+
+METRICS_RENDER = Topic(Key("metrics", "render"), RenderMetrics)
+
+
+def render_metrics(
+    *,
+    song_path: Path,
+    content_hash: str,
+    freq: int,
+    load_seconds: float,
+    map_seconds: float,
+    render_seconds: float,
+    frames_rendered: int,
+    song_length_frames: int,
+) -> RenderMetrics:
+    frames_per_second = frames_rendered / render_seconds if render_seconds else 0.0
+    return RenderMetrics(
+        song_path=song_path,
+        content_hash=content_hash,
+        load_seconds=load_seconds,
+        map_seconds=map_seconds,
+        render_seconds=render_seconds,
+        frames_rendered=frames_rendered,
+        song_length_frames=song_length_frames,
+        frames_per_second=frames_per_second,
+        # Seconds of audio produced per second of wall time.
+        realtime_factor=frames_per_second / freq,
+        peak_memory_bytes=peak_memory_bytes(),
+    )
+
+
+def reset_peak_memory():
+    # Writing 5 here resets the peak resident set size on Linux.
+    with contextlib.suppress(OSError):
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+
+
+def peak_memory_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@attrs.define
+class MetricsWriter:
+    """Records every render.metrics message in a local file.
+
+    JSON Lines output is appended, one object per render. Prometheus output is
+    a text-exposition snapshot of the latest render of every song, rewritten
+    in place so it can be picked up by node_exporter's textfile collector.
+    """
+
+    path: Path
+    format: MetricsFormat = MetricsFormat.jsonl
+
+    latest: dict[Path, RenderMetrics] = attrs.field(factory=dict)
+
+    def __attrs_post_init__(self):
+        METRICS_RENDER.subscribe(self.write)
+
+    def write(self, key, message: RenderMetrics):
+        if self.format == MetricsFormat.jsonl:
+            with self.path.open("a") as f:
+                f.write(json.dumps(metrics_dict(message)) + "\n")
+        else:
+            scratch = self.path.with_name(f".{self.path.name}.tmp")
+            self.latest[message.song_path] = message
+            scratch.write_text(prometheus_text(self.latest.values()))
+            os.replace(scratch, self.path)
+
+
+def metrics_dict(metrics: RenderMetrics) -> dict:
+    return attrs.asdict(
+        metrics,
+        value_serializer=lambda _, __, value: (
+            str(value) if isinstance(value, Path) else value
+        ),
+    )
+
+
+def prometheus_text(renders: Iterable[RenderMetrics]) -> str:
+    """One gauge per metric, with a sample for each song."""
+    samples = {}
+    for metrics in renders:
+        labels = '{song="%s"}' % str(metrics.song_path).replace(
+            "\\", "\\\\"
+        ).replace('"', '\\"')
+        for name, value in metrics_dict(metrics).items():
+            if name in ("song_path", "content_hash"):
+                continue
+            samples.setdefault(name, []).append(f"reloaper_{name}{labels} {value}")
+    lines = []
+    for name, metric_samples in samples.items():
+        lines.append(f"# TYPE reloaper_{name} gauge")
+        lines.extend(metric_samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,231 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import attrs
+import numpy as np
+
+import sunvox.api
+from reloaper.engine import RenderCancelled, init_sunvox, play_from, render_chunks
+from reloaper.songwatcher import file_hash
+from reloaper.timemap import TimeMap
+
+log = logging.getLogger(__name__)
+
+
+class SongChangedError(Exception):
+    """The song on disk is not the version a worker was asked to render."""
+
+
+@attrs.define
+class ParallelRenderer:
+    """Renders line ranges of a song in separate processes and stitches them.
+
+    Each worker process runs its own SunVox instance. A segment starts
+    `warmup_lines` before its first line, and the warm-up audio is thrown away
+    so that effect tails and LFOs have settled by the time the segment begins.
+    """
+
+    freq: int
+    workers: int
+    dtype: np.dtype = attrs.field(default=np.dtype(np.int16), converter=np.dtype)
+    chunk_size: int = 4096
+    warmup_lines: int = 64
+    verify_seams: bool = False
+    seam_frames: int = 4096
+    scratch_dir: Path | None = None
+
+    executor: ProcessPoolExecutor = attrs.field(init=False)
+    latest_seam_deviations: list[float] = attrs.field(factory=list)
+
+    def __attrs_post_init__(self):
+        # Workers must not inherit this process's SunVox state, so they are
+        # spawned rather than forked.
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.freq, self.dtype == np.float32),
+        )
+
+    def segments(self, time_map: TimeMap, song_length_frames: int) -> list[int]:
+        """Split the song into start lines of roughly equal length in frames."""
+        targets = np.linspace(0, song_length_frames, self.workers, endpoint=False)
+        start_lines = np.unique(np.searchsorted(time_map.starts, targets))
+        return [int(line) for line in start_lines if line < time_map.lines] or [0]
+
+    def render(
+        self,
+        song_path: Path,
+        time_map: TimeMap,
+        song_length_frames: int,
+        cancel_event: threading.Event,
+        on_segment: Callable[[np.ndarray, int, int], None] | None = None,
+        content_hash: str | None = None,
+    ) -> np.ndarray:
+        """Render the song, split at the lines given by `time_map`.
+
+        Workers load the song from disk themselves. With `content_hash` given,
+        a worker that finds a different version there stops, and the render is
+        cancelled since its segments would not line up.
+        """
+        start_lines = self.segments(time_map, song_length_frames)
+        log.debug(
+            "Rendering %r segments starting at lines %r",
+            len(start_lines),
+            start_lines,
+        )
+        shape = (song_length_frames, 2)
+        # Workers write their segments into one file-backed mapping. Once they
+        # are done the file is unlinked; the mapping stays valid, so the
+        # stitched song is returned without another copy.
+        fd, scratch_path = tempfile.mkstemp(
+            prefix="reloaper-",
+            suffix=".npy",
+            dir=self.scratch_dir or default_scratch_dir(),
+        )
+        os.close(fd)
+        try:
+            new_audio = np.lib.format.open_memmap(
+                scratch_path,
+                mode="w+",
+                dtype=self.dtype,
+                shape=shape,
+            )
+            futures = {}
+            for index, start_line in enumerate(start_lines):
+                end_line = (
+                    start_lines[index + 1]
+                    if index + 1 < len(start_lines)
+                    else time_map.lines
+                )
+                warmup_line = max(start_line - self.warmup_lines, 0)
+                start_frame, end_frame = time_map.line_frames(
+                    [start_line, end_line]
+                ).tolist()
+                future = self.executor.submit(
+                    render_segment,
+                    scratch_path=scratch_path,
+                    song_path=str(song_path),
+                    content_hash=content_hash,
+                    warmup_line=warmup_line,
+                    warmup_frame=time_map.line_frame(warmup_line),
+                    start_frame=start_frame,
+                    end_frame=end_frame,
+                    chunk_size=self.chunk_size,
+                    seam_frames=self.seam_frames if self.verify_seams else 0,
+                )
+                futures[future] = (index, start_frame, end_frame)
+            pending = set(futures)
+            seams = {}
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                changed = False
+                try:
+                    for future in done:
+                        index, start_frame, end_frame = futures[future]
+                        seams[index] = future.result()
+                        if on_segment is not None:
+                            on_segment(new_audio, start_frame, end_frame)
+                except SongChangedError:
+                    log.debug("Song changed on disk during a parallel render")
+                    changed = True
+                if changed or cancel_event.is_set():
+                    for future in pending:
+                        future.cancel()
+                    raise RenderCancelled()
+        finally:
+            os.unlink(scratch_path)
+        if self.verify_seams:
+            self.latest_seam_deviations = seam_deviations(
+                new_audio,
+                time_map,
+                start_lines,
+                seams,
+            )
+            log.info(
+                "Maximum sample deviation at seams: %r (per seam: %r)",
+                max(self.latest_seam_deviations, default=0),
+                self.latest_seam_deviations,
+            )
+        return new_audio
+
+
+def seam_deviations(
+    audio: np.ndarray,
+    time_map: TimeMap,
+    start_lines: list[int],
+    seams: dict[int, np.ndarray | None],
+) -> list[float]:
+    """Compare each segment's warm-up tail with the audio its neighbour rendered.
+
+    A worker's warm-up covers the frames just before its segment, which the
+    previous worker rendered for real; their difference shows how far the
+    warm-up had converged when the seam was crossed.
+    """
+    deviations = []
+    seam_frames = time_map.line_frames(start_lines)
+    for index in range(1, len(start_lines)):
+        warmup_tail = seams.get(index)
+        if warmup_tail is None or not len(warmup_tail):
+            continue
+        seam_frame = int(seam_frames[index])
+        reference = audio[seam_frame - len(warmup_tail) : seam_frame]
+        difference = np.abs(
+            reference.astype(np.float64) - warmup_tail.astype(np.float64)
+        )
+        deviations.append(float(difference.max()))
+    return deviations
+
+
+def init_worker(freq: int, float32: bool):
+    init_sunvox(freq=freq, float32=float32)
+
+
+def render_segment(
+    *,
+    scratch_path: str,
+    song_path: str,
+    content_hash: str | None,
+    warmup_line: int,
+    warmup_frame: int,
+    start_frame: int,
+    end_frame: int,
+    chunk_size: int,
+    seam_frames: int,
+) -> np.ndarray | None:
+    # Runs in a worker process and writes its segment straight into the
+    # shared scratch file.
+    dest = np.load(scratch_path, mmap_mode="r+")
+    warmup = np.ndarray((start_frame - warmup_frame, 2), dest.dtype)
+    check_song(song_path, content_hash)
+    with sunvox.api.Slot(song_path) as slot:
+        # Checked again in case the song was saved while it was being loaded.
+        check_song(song_path, content_hash)
+        play_from(slot, warmup_line)
+        for _ in render_chunks(warmup, chunk_size):
+            pass
+        for _ in render_chunks(dest[start_frame:end_frame], chunk_size):
+            pass
+        slot.stop()
+    dest.flush()
+    if not seam_frames:
+        return None
+    return warmup[-seam_frames:].copy()
+
+
+def check_song(song_path: str, content_hash: str | None):
+    if content_hash is not None and file_hash(Path(song_path)) != content_hash:
+        raise SongChangedError(song_path)
+
+
+def default_scratch_dir() -> str | None:
+    # Prefer a RAM-backed directory so the scratch file never touches disk.
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return None
@@ -0,0 +1,181 @@
+import attrs
+import numpy as np
+
+# Audio blocks reduced per pass, so the float64 squares stay small no matter
+# how long the song is.
+SLAB_BLOCKS = 1024
+
+
+@attrs.define
+class PeakLevel:
+    """Per-channel min, max and sum of squares over blocks of `block_frames`.
+
+    The last block may be shorter than the others if the song length is not a
+    multiple of `block_frames`.
+    """
+
+    block_frames: int
+    min: np.ndarray
+    max: np.ndarray
+    sum_squares: np.ndarray
+
+    def block_lengths(self, frames: int) -> np.ndarray:
+        starts = np.arange(len(self.min), dtype=np.int64) * self.block_frames
+        return np.minimum(frames - starts, self.block_frames)
+
+    def rms(self, frames: int) -> np.ndarray:
+        lengths = np.maximum(self.block_lengths(frames), 1)[:, None]
+        return np.sqrt(self.sum_squares / lengths)
+
+
+@attrs.define
+class PeakPyramid:
+    """Waveform summaries of a render at several resolutions.
+
+    Level 0 has `base_block_frames` frames per block and each following level
+    is `factor` times coarser, down to a single block, so any zoom level can be
+    drawn from a level with at most `factor` blocks per pixel.
+    """
+
+    frames: int
+    factor: int
+    levels: list[PeakLevel]
+
+    def level_for(self, frames_per_pixel: float) -> PeakLevel:
+        """Return the coarsest level whose blocks are no wider than a pixel."""
+        for level in reversed(self.levels):
+            if level.block_frames <= frames_per_pixel:
+                return level
+        return self.levels[0]
+
+    def updated(self, audio: np.ndarray, frame_ranges: np.ndarray) -> "PeakPyramid":
+        """Return a copy brought up to date with `audio`.
+
+        Only the blocks covering `frame_ranges` are recomputed, at every level.
+        """
+        base_block_frames = self.levels[0].block_frames
+        blocks = level_blocks(len(audio), base_block_frames, self.factor)
+        if len(blocks) != len(self.levels):
+            return build_peaks(audio, base_block_frames, self.factor)
+        levels = [
+            resized_level(level, count) for level, count in zip(self.levels, blocks)
+        ]
+        for start, end in frame_ranges:
+            first = int(start) // base_block_frames
+            last = -(-int(end) // base_block_frames)
+            reduce_audio(levels[0], audio, first, last)
+            for child, parent in zip(levels, levels[1:]):
+                first //= self.factor
+                last = -(-last // self.factor)
+                reduce_level(parent, child, first, last, self.factor)
+        return PeakPyramid(frames=len(audio), factor=self.factor, levels=levels)
+
+
+def level_blocks(frames: int, base_block_frames: int, factor: int) -> list[int]:
+    """Return the block count of each level, finest first."""
+    blocks = [max(-(-frames // base_block_frames), 1)]
+    while factor > 1 and blocks[-1] > 1:
+        blocks.append(-(-blocks[-1] // factor))
+    return blocks
+
+
+def empty_level(block_frames: int, blocks: int, dtype: np.dtype) -> PeakLevel:
+    return PeakLevel(
+        block_frames=block_frames,
+        min=np.zeros((blocks, 2), dtype),
+        max=np.zeros((blocks, 2), dtype),
+        sum_squares=np.zeros((blocks, 2), np.float64),
+    )
+
+
+def resized_level(level: PeakLevel, blocks: int) -> PeakLevel:
+    resized = empty_level(level.block_frames, blocks, level.min.dtype)
+    kept = min(blocks, len(level.min))
+    resized.min[:kept] = level.min[:kept]
+    resized.max[:kept] = level.max[:kept]
+    resized.sum_squares[:kept] = level.sum_squares[:kept]
+    return resized
+
+
+def reduce_audio(level: PeakLevel, audio: np.ndarray, first: int, last: int):
+    last = min(last, len(level.min))
+    for block in range(first, last, SLAB_BLOCKS):
+        end_block = min(block + SLAB_BLOCKS, last)
+        frames = audio[block * level.block_frames : end_block * level.block_frames]
+        if not len(frames):
+            continue
+        indices = np.arange(0, len(frames), level.block_frames)
+        count = len(indices)
+        level.min[block : block + count] = np.minimum.reduceat(frames, indices)
+        level.max[block : block + count] = np.maximum.reduceat(frames, indices)
+        level.sum_squares[block : block + count] = np.add.reduceat(
+            np.square(frames, dtype=np.float64), indices
+        )
+
+
+def reduce_level(
+    parent: PeakLevel,
+    child: PeakLevel,
+    first: int,
+    last: int,
+    factor: int,
+):
+    last = min(last, len(parent.min))
+    if first >= last:
+        return
+    begin = first * factor
+    end = min(last * factor, len(child.min))
+    indices = np.arange(0, end - begin, factor)
+    parent.min[first:last] = np.minimum.reduceat(child.min[begin:end], indices)
+    parent.max[first:last] = np.maximum.reduceat(child.max[begin:end], indices)
+    parent.sum_squares[first:last] = np.add.reduceat(
+        child.sum_squares[begin:end], indices
+    )
+
+
+def build_peaks(
+    audio: np.ndarray,
+    base_block_frames: int = 256,
+    factor: int = 4,
+) -> PeakPyramid:
+    """Summarize `audio` into a PeakPyramid."""
+    blocks = level_blocks(len(audio), base_block_frames, factor)
+    levels = [
+        empty_level(base_block_frames * factor**index, count, audio.dtype)
+        for index, count in enumerate(blocks)
+    ]
+    reduce_audio(levels[0], audio, 0, blocks[0])
+    for child, parent in zip(levels, levels[1:]):
+        reduce_level(parent, child, 0, len(parent.min), factor)
+    return PeakPyramid(frames=len(audio), factor=factor, levels=levels)
+
+
+def peaks_arrays(peaks: PeakPyramid) -> dict[str, np.ndarray]:
+    """Flatten a PeakPyramid into named arrays, e.g. for np.savez."""
+    arrays = {
+        "shape": np.array(
+            [peaks.frames, peaks.factor, peaks.levels[0].block_frames], np.int64
+        )
+    }
+    for index, level in enumerate(peaks.levels):
+        arrays[f"min_{index}"] = level.min
+        arrays[f"max_{index}"] = level.max
+        arrays[f"sum_squares_{index}"] = level.sum_squares
+    return arrays
+
+
+def peaks_from_arrays(arrays) -> PeakPyramid:
+    frames, factor, base_block_frames = (int(n) for n in arrays["shape"])
+    levels = []
+    index = 0
+    while f"min_{index}" in arrays:
+        levels.append(
+            PeakLevel(
+                block_frames=base_block_frames * factor**index,
+                min=arrays[f"min_{index}"],
+                max=arrays[f"max_{index}"],
+                sum_squares=arrays[f"sum_squares_{index}"],
+            )
+        )
+        index += 1
+    return PeakPyramid(frames=frames, factor=factor, levels=levels)
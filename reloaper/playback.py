@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+
+import attrs
+import numpy as np
+
+from reloaper.bufferpool import BufferPool, shared_pool
+from reloaper.loopregion import LOOP_CHANGED, LoopChanged
+from reloaper.songrenderer import (
+    LOOP_RENDERED,
+    SONG_RENDERED,
+    LoopRendered,
+    SongRendered,
+)
+from reloaper.timemap import TimeMap
+
+log = logging.getLogger(__name__)
+
+
+@attrs.frozen
+class PlaybackBuffer:
+    audio: np.ndarray
+    loop_start_frame: int
+    loop_end_frame: int
+    looping: bool
+
+
+@attrs.define
+class Playback:
+    """Streams the latest render to the sound card.
+
+    The audio thread only ever reads from an immutable PlaybackBuffer. The event
+    loop builds a new buffer for every render or loop change and queues it on
+    `commands`; the audio thread picks it up at the start of its next block, so
+    a swap never happens in the middle of a block and never blocks either side.
+
+    Buffers that have been swapped out are only released to the pool once the
+    audio thread has started a block after the swap, so a buffer is never
+    reused while it is still being played.
+    """
+
+    song_path: Path
+    freq: int
+    dtype: np.dtype = attrs.field(default=np.dtype(np.int16), converter=np.dtype)
+    blocksize: int = 1024
+    pool: BufferPool = shared_pool
+
+    loop_start_line: int | None = None
+    loop_length_lines: int | None = None
+    latest: SongRendered | None = None
+    latest_buffer: PlaybackBuffer | None = None
+    commands: deque = attrs.field(factory=deque)
+    # Swapped-out buffers, with the block count when they were swapped out.
+    retired: list[tuple[int, PlaybackBuffer]] = attrs.field(factory=list)
+
+    # Owned by the audio thread.
+    current: PlaybackBuffer | None = None
+    position: int = 0
+    playing: bool = False
+    blocks: int = 0
+
+    def __attrs_post_init__(self):
+        SONG_RENDERED.subscribe(self.on_rendered)
+        LOOP_CHANGED.subscribe(self.on_loop_changed)
+        LOOP_RENDERED.subscribe(self.on_loop_rendered)
+
+    async def run(self):
+        # Imported here so that rendering without playback does not need
+        # PortAudio installed.
+        import sounddevice
+
+        log.debug("Starting Playback stream")
+        with sounddevice.OutputStream(
+            samplerate=self.freq,
+            blocksize=self.blocksize,
+            channels=2,
+            dtype=self.dtype.name,
+            callback=self.audio_callback,
+        ):
+            await asyncio.Event().wait()
+
+    def play(self):
+        self.commands.append(("play", None))
+
+    def pause(self):
+        self.commands.append(("pause", None))
+
+    def stop(self):
+        self.commands.append(("pause", None))
+        self.commands.append(("seek", self.start_frame()))
+
+    def start_frame(self) -> int:
+        if self.latest_buffer is None or not self.latest_buffer.looping:
+            return 0
+        return self.latest_buffer.loop_start_frame
+
+    def current_line(self) -> int | None:
+        """The line at the playhead, for display."""
+        if self.latest is None:
+            return None
+        return self.latest.time_map.frame_line(self.position)
+
+    def on_rendered(self, key, message: SongRendered):
+        if message.song_path != self.song_path:
+            return
+        # Kept to rebuild the buffer when the loop changes, so both the audio
+        # and its time map are held until the next render replaces them.
+        self.pool.retain(message.audio)
+        self.pool.retain(message.time_map)
+        if self.latest is not None:
+            self.pool.release(self.latest.audio)
+            self.pool.release(self.latest.time_map)
+        self.latest = message
+        self.swap_buffer()
+
+    def on_loop_changed(self, key, message: LoopChanged):
+        self.loop_start_line = message.start_line
+        self.loop_length_lines = message.length_lines
+        self.swap_buffer()
+
+    def on_loop_rendered(self, key, message: LoopRendered):
+        # The rest of the audio is not rendered yet, so this is only safe to
+        # play while looping over the same lines.
+        if message.song_path != self.song_path:
+            return
+        if (message.start_line, message.length_lines) != (
+            self.loop_start_line,
+            self.loop_length_lines,
+        ):
+            return
+        self.install_buffer(self.make_buffer(message.audio, message.time_map))
+
+    def swap_buffer(self):
+        if self.latest is None:
+            return
+        self.install_buffer(self.make_buffer(self.latest.audio, self.latest.time_map))
+
+    def make_buffer(self, audio: np.ndarray, time_map: TimeMap) -> PlaybackBuffer:
+        song_length_frames = len(audio)
+        if self.loop_start_line is None or not self.loop_length_lines:
+            return PlaybackBuffer(
+                audio=audio,
+                loop_start_frame=0,
+                loop_end_frame=song_length_frames,
+                looping=False,
+            )
+        loop_start_frame, loop_end_frame = time_map.line_frames(
+            [self.loop_start_line, self.loop_start_line + self.loop_length_lines]
+        ).tolist()
+        # The audio need not be as long as the time map says, so the loop is
+        # kept within it. A loop left with no frames is not played as one.
+        loop_start_frame = min(loop_start_frame, song_length_frames)
+        loop_end_frame = min(loop_end_frame, song_length_frames)
+        return PlaybackBuffer(
+            audio=audio,
+            loop_start_frame=loop_start_frame,
+            loop_end_frame=loop_end_frame,
+            looping=loop_end_frame > loop_start_frame,
+        )
+
+    def install_buffer(self, buffer: PlaybackBuffer):
+        self.pool.retain(buffer.audio)
+        previous, self.latest_buffer = self.latest_buffer, buffer
+        self.commands.append(("swap", buffer))
+        if previous is not None:
+            self.retired.append((self.blocks, previous))
+        self.release_retired()
+        if buffer.looping and (
+            previous is None
+            or (previous.loop_start_frame, previous.loop_end_frame)
+            != (buffer.loop_start_frame, buffer.loop_end_frame)
+        ):
+            log.debug("Loop frames changed; moving playhead to loop start")
+            self.commands.append(("seek", buffer.loop_start_frame))
+
+    def release_retired(self):
+        # A block that started after a buffer was swapped out has already
+        # taken the swap; the block running at the time may still be reading.
+        blocks = self.blocks
+        still_playing = []
+        for retired_at, buffer in self.retired:
+            if blocks > retired_at + 1:
+                self.pool.release(buffer.audio)
+            else:
+                still_playing.append((retired_at, buffer))
+        self.retired = still_playing
+
+    def audio_callback(self, outdata: np.ndarray, frames: int, time, status):
+        # Runs on the sound card thread: no locks, no buffer allocation.
+        commands = self.commands
+        while commands:
+            command, arg = commands.popleft()
+            if command == "swap":
+                self.current = arg
+            elif command == "seek":
+                self.position = arg
+            elif command == "play":
+                self.playing = True
+            elif command == "pause":
+                self.playing = False
+        buffer = self.current
+        written = 0
+        while written < frames and self.playing and buffer is not None:
+            end = buffer.loop_end_frame if buffer.looping else len(buffer.audio)
+            if self.position >= end:
+                if buffer.looping:
+                    self.position = buffer.loop_start_frame
+                else:
+                    self.playing = False
+                    self.position = 0
+                    break
+            count = min(frames - written, end - self.position)
+            outdata[written : written + count] = buffer.audio[
+                self.position : self.position + count
+            ]
+            written += count
+            self.position += count
+        if written < frames:
+            outdata[written:] = 0
+        self.blocks += 1
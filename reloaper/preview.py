@@ -0,0 +1,86 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import attrs
+import numpy as np
+
+import sunvox.api
+from reloaper.engine import play_from, render_chunks
+from reloaper.parallel import init_worker
+from reloaper.songwatcher import file_hash
+
+log = logging.getLogger(__name__)
+
+
+@attrs.define
+class PreviewRenderer:
+    """Renders a quick, lower-quality draft of a song ahead of the real render.
+
+    SunVox's sample rate is fixed when the library is initialized, so drafts
+    are rendered at `freq` by a separate process and stretched back to the
+    playback rate before they are published.
+    """
+
+    freq: int = 11025
+    dtype: np.dtype = attrs.field(default=np.dtype(np.int16), converter=np.dtype)
+    chunk_size: int = 16384
+
+    executor: ProcessPoolExecutor = attrs.field(init=False)
+
+    def __attrs_post_init__(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.freq, self.dtype == np.float32),
+        )
+
+
+def render_preview(
+    song_path: str,
+    content_hash: str,
+    dtype: str,
+    chunk_size: int,
+) -> np.ndarray | None:
+    # Runs in the preview process. Jobs queue up behind each other while the
+    # song is being edited, so one whose version is no longer on disk returns
+    # None straight away instead of rendering a draft nobody will use.
+    if file_hash(Path(song_path)) != content_hash:
+        return None
+    with sunvox.api.Slot(song_path) as slot:
+        if file_hash(Path(song_path)) != content_hash:
+            return None
+        audio = np.ndarray((slot.get_song_length_frames(), 2), dtype)
+        play_from(slot, 0)
+        for _ in render_chunks(audio, chunk_size):
+            pass
+        slot.stop()
+    return audio
+
+
+def stretch(
+    draft: np.ndarray,
+    frames: int,
+    previous_audio: np.ndarray | None = None,
+    splice_frame: int = 0,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """Resample `draft` to `frames` frames by nearest neighbour.
+
+    The first `splice_frame` frames are taken from `previous_audio` instead,
+    so audio that has not changed keeps its full quality. The result is
+    written to `out` if given.
+    """
+    audio = np.ndarray((frames, 2), draft.dtype) if out is None else out
+    if splice_frame:
+        audio[:splice_frame] = previous_audio[:splice_frame]
+    if len(draft):
+        indices = np.arange(splice_frame, frames, dtype=np.int64)
+        indices *= len(draft)
+        indices //= max(frames, 1)
+        np.take(draft, indices, axis=0, out=audio[splice_frame:])
+    else:
+        audio[splice_frame:] = 0
+    return audio
@@ -1,12 +1,156 @@
+import asyncio
 import logging
+from collections import deque
+from collections.abc import Callable
+from enum import Enum
+from typing import Generic, TypeVar
 
 import aiopubsub
+import attrs
 from aiopubsub import Key
 
 log = logging.getLogger(__name__)
 
 hub = aiopubsub.Hub()
 
+T = TypeVar("T")
+
+
+class Overflow(str, Enum):
+    drop_oldest = "drop_oldest"
+    block = "block"
+
+
+@attrs.define(eq=False)
+class Topic(Generic[T]):
+    """A hub key that only carries messages of one type.
+
+    Topics are declared next to their message class, e.g. SONG_CHANGED in
+    reloaper.songwatcher, and are published and subscribed to instead of bare
+    keys.
+    """
+
+    key: Key
+    message_type: type[T]
+    blocking: list["Subscription[T]"] = attrs.field(factory=list)
+
+    def publish(self, message: T):
+        assert isinstance(message, self.message_type), (self.key, message)
+        hub.publish(self.key, message)
+
+    async def publish_wait(self, message: T):
+        """Publish once every blocking subscription has room for the message."""
+        for subscription in self.blocking:
+            await subscription.wait_for_room()
+        self.publish(message)
+
+    def publish_threadsafe(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        message: T,
+        done: Callable[[], None] | None = None,
+    ):
+        """Publish from another thread, waiting for room if a subscriber blocks.
+
+        `done` is called once the message has been published, so the sender
+        can hold on to whatever the message refers to until then.
+        """
+        if self.blocking:
+            try:
+                publish = self.publish_wait(message)
+                asyncio.run_coroutine_threadsafe(publish, loop).result()
+            finally:
+                if done is not None:
+                    done()
+        else:
+            loop.call_soon_threadsafe(self.publish_then, message, done)
+
+    def publish_then(self, message: T, done: Callable[[], None] | None):
+        try:
+            self.publish(message)
+        finally:
+            if done is not None:
+                done()
+
+    def subscribe(self, callback: Callable[[Key, T], None]):
+        hub.add_subscriber(self.key, callback)
+
+    def unsubscribe(self, callback: Callable[[Key, T], None]):
+        hub.remove_subscriber(self.key, callback)
+
+    def queue(
+        self,
+        maxsize: int,
+        overflow: Overflow = Overflow.drop_oldest,
+    ) -> "Subscription[T]":
+        """Subscribe with a bounded queue, consumed with `async for`."""
+        subscription = Subscription(topic=self, maxsize=maxsize, overflow=overflow)
+        self.subscribe(subscription.put)
+        if overflow == Overflow.block:
+            self.blocking.append(subscription)
+        return subscription
+
+
+@attrs.define(eq=False)
+class Subscription(Generic[T]):
+    """A bounded queue of messages from one topic.
+
+    When the queue is full, a drop_oldest subscription discards its oldest
+    message to make room. A block subscription makes Topic.publish_wait and
+    Topic.publish_threadsafe wait until the consumer catches up; a plain
+    Topic.publish still never waits, so it drops the oldest message too.
+    """
+
+    topic: Topic[T]
+    maxsize: int
+    overflow: Overflow = Overflow.drop_oldest
+    messages: deque = attrs.field(factory=deque)
+    dropped: int = 0
+    ready: asyncio.Event = attrs.field(factory=asyncio.Event)
+    room: asyncio.Event = attrs.field(factory=asyncio.Event)
+
+    def __attrs_post_init__(self):
+        self.room.set()
+
+    def put(self, key, message: T):
+        if len(self.messages) >= self.maxsize:
+            self.messages.popleft()
+            self.dropped += 1
+            log.debug("Dropped a message from a full %r queue", self.topic.key)
+        self.messages.append(message)
+        self.ready.set()
+        if len(self.messages) >= self.maxsize:
+            self.room.clear()
+
+    async def get(self) -> T:
+        while not self.messages:
+            self.ready.clear()
+            await self.ready.wait()
+        message = self.messages.popleft()
+        self.room.set()
+        return message
+
+    async def wait_for_room(self):
+        await self.room.wait()
+
+    def close(self):
+        self.topic.unsubscribe(self.put)
+        if self in self.topic.blocking:
+            self.topic.blocking.remove(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> T:
+        return await self.get()
+
 
 def message_logger(key, message):
     log.debug("%r %r", key, message)
+
+
+def init_hub_logging():
+    # Subscribed only when debug logging is on: otherwise every message on
+    # every topic would pay for a callback that logs nothing.
+    if log.isEnabledFor(logging.DEBUG):
+        hub.add_subscriber(Key("*"), message_logger)
@@ -0,0 +1,137 @@
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import attrs
+import numpy as np
+
+from reloaper.peaks import PeakPyramid, peaks_arrays, peaks_from_arrays
+from reloaper.timemap import TimeMap
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2 << 30
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if cache_home:
+        return Path(cache_home) / "reloaper"
+    return Path.home() / ".cache" / "reloaper"
+
+
+@attrs.frozen
+class CacheKey:
+    content_hash: str
+    freq: int
+    render_format: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.content_hash}-{self.freq}-{self.render_format}"
+
+
+@attrs.define
+class CachedRender:
+    audio: np.ndarray
+    time_map: TimeMap
+    peaks: PeakPyramid | None = None
+
+
+@attrs.define
+class RenderCache:
+    """Finished renders on disk, one directory of .npy files per CacheKey.
+
+    Entries are opened memory-mapped and read-only, so a hit costs no copy and
+    every process reading the same render shares the OS page cache.
+
+    With `max_bytes` set, storing an entry evicts the least recently used
+    ones until the cache fits. Loading an entry touches its directory, so its
+    modification time says when it was last used.
+    """
+
+    root: Path
+    max_bytes: int | None = DEFAULT_MAX_BYTES
+
+    def entry_path(self, key: CacheKey) -> Path:
+        return self.root / key.name
+
+    def load(self, key: CacheKey) -> CachedRender | None:
+        path = self.entry_path(key)
+        try:
+            cached = CachedRender(
+                audio=np.load(path / "audio.npy", mmap_mode="r"),
+                time_map=TimeMap(np.load(path / "time_map.npy", mmap_mode="r")),
+            )
+        except FileNotFoundError:
+            return None
+        if cached.time_map.buffer.ndim != 2:
+            log.debug("Ignoring cached render with an old time map at %r", path)
+            return None
+        try:
+            with np.load(path / "peaks.npz") as arrays:
+                cached.peaks = peaks_from_arrays(dict(arrays))
+        except FileNotFoundError:
+            # Entries written before peaks were cached.
+            pass
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return cached
+
+    def store(
+        self,
+        key: CacheKey,
+        audio: np.ndarray,
+        time_map: TimeMap,
+        peaks: PeakPyramid | None = None,
+    ):
+        path = self.entry_path(key)
+        if path.exists():
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Write into a scratch directory and rename it into place, so readers
+        # never see a half-written entry.
+        scratch = Path(tempfile.mkdtemp(prefix=f".{key.name}-", dir=self.root))
+        try:
+            np.save(scratch / "audio.npy", audio)
+            np.save(scratch / "time_map.npy", time_map.buffer)
+            if peaks is not None:
+                np.savez(scratch / "peaks.npz", **peaks_arrays(peaks))
+            os.rename(scratch, path)
+        except OSError:
+            if not path.exists():
+                raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        log.debug("Stored render in cache at %r", path)
+        self.evict(keep=path)
+
+    def evict(self, keep: Path | None = None):
+        """Remove the least recently used entries until the cache fits."""
+        if not self.max_bytes:
+            return
+        entries = []
+        total = 0
+        for path in self.root.iterdir():
+            # Scratch directories of stores in progress start with a dot.
+            if path.name.startswith(".") or not path.is_dir():
+                continue
+            try:
+                used = path.stat().st_mtime
+                size = sum(file.stat().st_size for file in path.iterdir())
+            except OSError:
+                continue
+            entries.append((used, size, path))
+            total += size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            log.debug("Evicting cached render at %r", path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
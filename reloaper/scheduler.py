@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+import glob
+import heapq
+import itertools
+import logging
+from pathlib import Path
+
+import attrs
+
+log = logging.getLogger(__name__)
+
+
+@attrs.define
+class RenderScheduler:
+    """Caps how many songs render at once and decides who goes next.
+
+    Renders wait for a permit; when one is free it goes to the waiting render
+    with the highest priority. SongRenderer uses the song's modification time,
+    so the most recently edited song is rendered first.
+    """
+
+    max_renders: int = 1
+
+    running: int = 0
+    waiting: list = attrs.field(factory=list)
+    counter: itertools.count = attrs.field(factory=itertools.count)
+
+    @contextlib.asynccontextmanager
+    async def permit(self, priority: float):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: float):
+        if self.running < self.max_renders and not self.waiting:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        # Highest priority first; among equals, first come first served.
+        heapq.heappush(self.waiting, (-priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The permit was granted just as the waiter was cancelled.
+                self.release()
+            raise
+
+    def release(self):
+        self.running -= 1
+        while self.waiting and self.running < self.max_renders:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+
+
+def is_song_pattern(pattern: str) -> bool:
+    """Whether `pattern` names a directory or glob rather than a single song.
+
+    Either can match songs that are added later, however many it matches now.
+    """
+    return Path(pattern).is_dir() or glob.has_magic(pattern)
+
+
+def song_root(pattern: str) -> Path:
+    """Return the directory that songs named by `pattern` are added to."""
+    path = Path(pattern)
+    if path.is_dir():
+        return path
+    if not glob.has_magic(pattern):
+        return path.parent
+    parts = itertools.takewhile(lambda part: not glob.has_magic(part), path.parts)
+    return Path(*parts)
+
+
+def expand_song_paths(pattern: str) -> list[Path]:
+    """Return the songs named by a file, a directory or a glob pattern."""
+    path = Path(pattern)
+    if path.is_dir():
+        return sorted(p.resolve() for p in path.glob("*.sunvox"))
+    if glob.has_magic(pattern):
+        return sorted(Path(p).resolve() for p in glob.glob(pattern, recursive=True))
+    return [path.resolve()]
@@ -0,0 +1,235 @@
+import enum
+import io
+import logging
+from itertools import takewhile
+
+import attrs
+import numpy as np
+from rv.api import Project, read_sunvox_file
+from rv.pattern import Pattern
+
+log = logging.getLogger(__name__)
+
+# Project header chunks that change how the song is timed, and ones that change
+# how it sounds. Anything else in the header is editor state or metadata.
+TIMING_CHUNKS = {b"BPM ", b"SPED"}
+SOUND_CHUNKS = {b"GVOL", b"FLGS"}
+FIRST_BODY_CHUNKS = {b"PDTA", b"PPAR", b"PEND", b"SFFF", b"SEND"}
+
+# Module chunks that only matter to the editor: name, position, colour, MIDI.
+MODULE_METADATA_CHUNKS = {
+    b"SNAM",
+    b"SXXX",
+    b"SYYY",
+    b"SZZZ",
+    b"SSCL",
+    b"SVPR",
+    b"SCOL",
+    b"SMII",
+    b"SMIN",
+    b"SMIC",
+    b"SMIB",
+    b"SMIP",
+}
+
+# Pattern flags that change what is heard. Soloing one pattern silences all
+# the others.
+PATTERN_MUTE = 0x08
+PATTERN_SOLO = 0x10
+
+# Each note is 8 bytes: note, velocity, module (2), controller and effect
+# (2), value (2). This picks out the effect byte of a note read as a word.
+EFFECT_MASK = np.uint64(0xFF << 32)
+
+
+class ChangeKind(enum.Flag):
+    NONE = 0
+    METADATA = enum.auto()
+    PATTERN_DATA = enum.auto()
+    MODULES = enum.auto()
+    TIMING = enum.auto()
+
+
+class Work(enum.IntEnum):
+    """What has to be redone for a change, cheapest first."""
+
+    # Nothing that affects the audio changed.
+    SKIP = 0
+    # Timing is unchanged: reuse the time map and render from `first_line`.
+    PARTIAL_RENDER = 1
+    # Timing is unchanged: reuse the time map and render the whole song.
+    FULL_RENDER = 2
+    # Timing changed: rebuild the time map, and let its comparison with the
+    # previous one decide what to render.
+    REMAP = 3
+
+
+@attrs.frozen
+class SongChange:
+    """How a song differs from the version with content hash `old_hash`.
+
+    `first_line` is the first line known to sound different. With a timing
+    change it only covers muted, unmuted and soloed patterns, and the time map
+    comparison may find an earlier one.
+    """
+
+    old_hash: str
+    kinds: ChangeKind
+    first_line: int | None = None
+
+    @property
+    def work(self) -> Work:
+        if ChangeKind.TIMING in self.kinds:
+            return Work.REMAP
+        if ChangeKind.MODULES in self.kinds:
+            return Work.FULL_RENDER
+        if ChangeKind.PATTERN_DATA in self.kinds:
+            return Work.PARTIAL_RENDER
+        return Work.SKIP
+
+
+def read_song(data: bytes) -> Project | None:
+    """Parse a song with Radiant Voices; None if it cannot be read."""
+    try:
+        project = read_sunvox_file(io.BytesIO(data))
+    except Exception:
+        log.debug("Radiant Voices could not read the song", exc_info=True)
+        return None
+    return project if isinstance(project, Project) else None
+
+
+def classify_change(old: Project, new: Project, old_hash: str) -> SongChange:
+    kinds = ChangeKind.NONE
+    old_header = header_chunks(old)
+    new_header = header_chunks(new)
+    for name in old_header.keys() | new_header.keys():
+        if old_header.get(name) == new_header.get(name):
+            continue
+        if name in TIMING_CHUNKS:
+            kinds |= ChangeKind.TIMING
+        elif name in SOUND_CHUNKS:
+            kinds |= ChangeKind.MODULES
+        else:
+            kinds |= ChangeKind.METADATA
+    if module_states(old) != module_states(new):
+        kinds |= ChangeKind.MODULES
+    pattern_kinds, first_line = compare_patterns(old, new)
+    return SongChange(
+        old_hash=old_hash,
+        kinds=kinds | pattern_kinds,
+        first_line=first_line,
+    )
+
+
+def header_chunks(project: Project) -> dict[bytes, bytes]:
+    # Project.chunks() is a generator, so stopping at the first pattern chunk
+    # never serializes pattern data.
+    return dict(takewhile(lambda c: c[0] not in FIRST_BODY_CHUNKS, project.chunks()))
+
+
+def module_states(project: Project) -> list:
+    states = []
+    for module in project.modules:
+        if module is None:
+            states.append(None)
+            continue
+        chunks = [
+            chunk
+            for chunk in module.iff_chunks(in_project=True)
+            if chunk[0] not in MODULE_METADATA_CHUNKS
+        ]
+        if module.chnk:
+            chunks.extend(module.specialized_iff_chunks())
+        states.append(
+            (
+                chunks,
+                tuple(module.in_links),
+                tuple(module.in_link_slots),
+                tuple(module.get_raw(name) for name in module.controllers),
+            )
+        )
+    return states
+
+
+def compare_patterns(old: Project, new: Project) -> tuple[ChangeKind, int | None]:
+    if pattern_layout(old) != pattern_layout(new):
+        return ChangeKind.TIMING, None
+    kinds = ChangeKind.NONE
+    audible = audibility_changes(old, new)
+    first_line = min((max(pattern.x, 0) for pattern in audible), default=None)
+    if audible:
+        kinds |= ChangeKind.PATTERN_DATA
+        sources = (pattern_source(new, pattern) for pattern in audible)
+        if any((pattern_words(source) & EFFECT_MASK).any() for source in sources):
+            # Muting a pattern also mutes any speed changes or jumps in it.
+            return ChangeKind.TIMING, first_line
+    # First changed line within each pattern whose data changed.
+    changed = {}
+    for index, (old_pattern, new_pattern) in enumerate(zip(old.patterns, new.patterns)):
+        if not isinstance(new_pattern, Pattern):
+            continue
+        if (old_pattern.name, old_pattern.y) != (new_pattern.name, new_pattern.y):
+            kinds |= ChangeKind.METADATA
+        old_words = pattern_words(old_pattern)
+        new_words = pattern_words(new_pattern)
+        (lines,) = np.nonzero((old_words != new_words).any(axis=1))
+        if not len(lines):
+            continue
+        effects = np.concatenate([old_words[lines], new_words[lines]]) & EFFECT_MASK
+        if effects.any():
+            # Effects on changed lines may set the speed or jump around the
+            # song, so the time map has to be rebuilt.
+            return ChangeKind.TIMING, first_line
+        changed[index] = int(lines[0])
+    for index, pattern in enumerate(new.patterns):
+        if pattern is None:
+            continue
+        # Clones play their source pattern's data at their own position.
+        source = index if isinstance(pattern, Pattern) else pattern.source
+        if source not in changed:
+            continue
+        kinds |= ChangeKind.PATTERN_DATA
+        line = max(pattern.x + changed[source], 0)
+        first_line = line if first_line is None else min(first_line, line)
+    return kinds, first_line
+
+
+def pattern_layout(project: Project) -> list:
+    layout = []
+    for pattern in project.patterns:
+        if pattern is None:
+            layout.append(None)
+        elif isinstance(pattern, Pattern):
+            layout.append((pattern.x, pattern.lines, pattern.tracks))
+        else:
+            layout.append((pattern.x, pattern.source))
+    return layout
+
+
+def audibility_changes(old: Project, new: Project) -> list:
+    """Patterns that were muted, unmuted or soloed, given the same layout."""
+    changed = []
+    solo_changed = False
+    for old_pattern, new_pattern in zip(old.patterns, new.patterns):
+        if new_pattern is None:
+            continue
+        flags = old_pattern.flags_PFFF ^ new_pattern.flags_PFFF
+        if flags & PATTERN_SOLO:
+            solo_changed = True
+        if flags & PATTERN_MUTE:
+            changed.append(new_pattern)
+    if solo_changed:
+        return [pattern for pattern in new.patterns if pattern is not None]
+    return changed
+
+
+def pattern_source(project: Project, pattern) -> Pattern:
+    if isinstance(pattern, Pattern):
+        return pattern
+    return project.patterns[pattern.source]
+
+
+def pattern_words(pattern: Pattern) -> np.ndarray:
+    """View a pattern's notes as a (lines, tracks) array of uint64 words."""
+    words = np.frombuffer(pattern.raw_data, np.uint64)
+    return words.reshape(pattern.lines, pattern.tracks)
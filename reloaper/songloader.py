@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import time
+from pathlib import Path
+
+import attrs
+
+import sunvox.api
+from reloaper.pubsub import Key, Topic
+from reloaper.songchange import SongChange, Work
+from reloaper.songwatcher import SONG_CHANGED, SongChanged
+
+log = logging.getLogger(__name__)
+
+
+@attrs.define
+class SlotPool:
+    """Caps how many songs are loaded at once.
+
+    SunVox has a fixed number of slots, so with many songs a loader waits here
+    for a free one instead of failing. The slot is given back when the
+    SongHandle holding it is closed.
+    """
+
+    max_slots: int = sunvox.api.MAX_SLOTS
+
+    semaphore: asyncio.Semaphore = attrs.field(init=False)
+
+    def __attrs_post_init__(self):
+        self.semaphore = asyncio.Semaphore(self.max_slots)
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+
+    def release(self):
+        self.semaphore.release()
+
+
+@attrs.define
+class SongLoader:
+    song_path: Path
+    slots: SlotPool | None = None
+
+    load_event: asyncio.Event = attrs.field(factory=asyncio.Event)
+    pending_hash: str | None = None
+    pending_change: SongChange | None = None
+
+    def __attrs_post_init__(self):
+        SONG_CHANGED.subscribe(self.trigger_load)
+
+    async def load_loop(self):
+        log.debug("Starting SongLoader load loop")
+        while True:
+            await self.load_event.wait()
+            if self.slots is not None:
+                await self.slots.acquire()
+            # Changes seen while waiting for a slot are loaded now as well.
+            self.load_event.clear()
+            content_hash, change = self.pending_hash, self.pending_change
+            log.debug("Loading song...")
+            started = time.perf_counter()
+            # Loading parses the whole file, so it happens off the event loop.
+            load = asyncio.ensure_future(asyncio.to_thread(load_slot, self.song_path))
+            try:
+                slot, timestamp = await asyncio.shield(load)
+            except asyncio.CancelledError:
+                load.add_done_callback(self.discard_load)
+                raise
+            except Exception:
+                log.exception("Could not load %s", self.song_path)
+                if self.slots is not None:
+                    self.slots.release()
+                continue
+            handle = SongHandle(
+                slot=slot,
+                timestamp=timestamp,
+                content_hash=content_hash,
+                load_seconds=time.perf_counter() - started,
+                change=change,
+                slots=self.slots,
+            )
+            log.debug("Loaded song into slot %r", handle.slot.number)
+            SONG_LOADED.publish(SongLoaded(song_path=self.song_path, handle=handle))
+            # Subscribers acquire the handle while it is being published,
+            # so the loader's own reference can be dropped right away.
+            handle.release()
+
+    def discard_load(self, load: asyncio.Future):
+        # The loop was cancelled while a load was running on its thread.
+        if load.cancelled() or load.exception() is not None:
+            return
+        slot, _ = load.result()
+        slot.close()
+        if self.slots is not None:
+            self.slots.release()
+
+    def close(self):
+        SONG_CHANGED.unsubscribe(self.trigger_load)
+
+    def trigger_load(self, key, message: SongChanged):
+        if message.song_path != self.song_path:
+            return
+        change = message.change
+        if change is not None and change.work == Work.SKIP:
+            if not self.load_event.is_set():
+                log.debug("Only metadata changed; not reloading the song")
+                return
+            # A load is already pending, and this version sounds the same, so
+            # it may as well be the one that is loaded.
+            change = self.pending_change
+        self.pending_change = change
+        self.pending_hash = message.content_hash
+        self.load_event.set()
+
+
+# sunvox.api.Slot picks its slot number without a lock, so slots are opened
+# one at a time; the songs themselves load concurrently.
+slot_lock = threading.Lock()
+
+
+def load_slot(song_path: Path) -> tuple[sunvox.api.Slot, float]:
+    """Load a song into a new slot; return it with the file's mtime."""
+    with slot_lock:
+        slot = sunvox.api.Slot()
+    try:
+        if slot.load(song_path) != 0:
+            raise OSError(f"SunVox could not load {song_path}")
+        return slot, song_path.stat().st_mtime
+    except BaseException:
+        slot.close()
+        raise
+
+
+@attrs.define(eq=False)
+class SongHandle:
+    """A loaded song slot, shared by every stage that consumes it.
+
+    Each consumer calls `acquire` when it takes the handle and `release` when it
+    is done with it. The slot is closed once the last reference is released.
+    """
+
+    slot: sunvox.api.Slot
+    timestamp: float
+    content_hash: str
+    load_seconds: float = 0.0
+    change: SongChange | None = None
+    slots: SlotPool | None = None
+    refcount: int = 1
+
+    def acquire(self) -> "SongHandle":
+        self.refcount += 1
+        return self
+
+    def release(self):
+        self.refcount -= 1
+        if self.refcount == 0:
+            log.debug("Closing slot %r", self.slot.number)
+            self.slot.close()
+            if self.slots is not None:
+                self.slots.release()
+
+
+@attrs.define
+class SongLoaded:
+    song_path: Path
+    handle: SongHandle
+
+
+SONG_LOADED = Topic(Key("song", "loaded"), SongLoaded)
@@ -1,14 +1,18 @@
 import asyncio
-import ctypes
 import logging
+import time
 from datetime import datetime
 from pathlib import Path
 
 import attrs
-import numpy as np
 
 import sunvox.api
-from reloaper.pubsub import hub, Key
+from reloaper.bufferpool import BufferPool, shared_pool
+from reloaper.pubsub import Key, Topic
+from reloaper.songchange import Work
+from reloaper.songloader import SONG_LOADED, SongHandle, SongLoaded
+from reloaper.songsignature import SongSignature, song_signature
+from reloaper.timemap import TimeMap
 
 log = logging.getLogger(__name__)
 
@@ -16,34 +20,118 @@ log = logging.getLogger(__name__)
 @attrs.define
 class SongMapper:
     song_path: Path
+    pool: BufferPool = shared_pool
 
-    latest_map: np.ndarray | None = None
+    latest_map: TimeMap | None = None
     latest_map_timestamp: datetime | None = None
+    latest_map_hash: str | None = None
     render_event: asyncio.Event = attrs.field(factory=asyncio.Event)
+    pending: SongHandle | None = None
 
     def __attrs_post_init__(self):
-        hub.add_subscriber(Key("song", "changed"), self.trigger_render)
+        SONG_LOADED.subscribe(self.trigger_render)
 
     async def render_loop(self):
         log.debug("Starting SongMapper render loop")
         while True:
             await self.render_event.wait()
             self.render_event.clear()
+            handle, self.pending = self.pending, None
             log.debug("Rendering song map...")
-            with sunvox.api.Slot(self.song_path) as slot:
-                song_length_lines = slot.get_song_length_lines()
-                new_map = np.zeros(song_length_lines, np.uint32)
-                get_time_map_result = slot.get_time_map(
-                    start_line=0,
-                    len=song_length_lines,
-                    dest=new_map.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)),
-                    flags=sunvox.api.TIME_MAP.FRAMECNT,
-                )
-                log.debug("get_time_map_result %r", get_time_map_result)
+            try:
+                started = time.perf_counter()
+                if self.timing_unchanged(handle):
+                    log.debug("Timing is unchanged; reusing the previous map")
+                    new_map = self.latest_map
+                    signature = await self.read_slot(
+                        handle, song_signature, new_map.lines
+                    )
+                else:
+                    new_map, signature = await self.read_slot(
+                        handle, map_song, self.pool
+                    )
+                map_seconds = time.perf_counter() - started
+                if new_map is not self.latest_map:
+                    # Stages still using the previous map hold their own
+                    # reference to it.
+                    self.pool.release(self.latest_map)
                 self.latest_map = new_map
-                self.latest_map_timestamp = self.song_path.stat().st_mtime
-                log.debug("latest_map[:5] %r", self.latest_map[:5])
+                self.latest_map_timestamp = handle.timestamp
+                self.latest_map_hash = handle.content_hash
+                log.debug("latest_map[:5] %r", self.latest_map.offsets[:5])
                 log.debug("latest_map_timestamp %r", self.latest_map_timestamp)
+                SONG_MAPPED.publish(
+                    SongMapped(
+                        song_path=self.song_path,
+                        handle=handle,
+                        time_map=new_map,
+                        signature=signature,
+                        map_seconds=map_seconds,
+                    ),
+                )
+            except Exception:
+                # A song that fails to map is mapped again when it changes.
+                log.exception("Could not map %s", self.song_path)
+            finally:
+                handle.release()
+
+    async def read_slot(self, handle: SongHandle, function, *args):
+        """Call `function(handle.slot, *args)` off the event loop.
+
+        The handle is held until the call returns, even if the caller is
+        cancelled first, so the slot is never closed while it is being read.
+        """
+        handle.acquire()
+        work = asyncio.ensure_future(asyncio.to_thread(function, handle.slot, *args))
+        work.add_done_callback(lambda _: handle.release())
+        return await asyncio.shield(work)
 
-    def trigger_render(self, key, message):
+    def timing_unchanged(self, handle: SongHandle) -> bool:
+        change = handle.change
+        return (
+            change is not None
+            and change.work in (Work.PARTIAL_RENDER, Work.FULL_RENDER)
+            and change.old_hash == self.latest_map_hash
+        )
+
+    def close(self):
+        SONG_LOADED.unsubscribe(self.trigger_render)
+        if self.pending is not None:
+            self.pending.release()
+            self.pending = None
+        self.pool.release(self.latest_map)
+        self.latest_map = None
+
+    def trigger_render(self, key, message: SongLoaded):
+        if message.song_path != self.song_path:
+            return
+        if self.pending is not None:
+            self.pending.release()
+        self.pending = message.handle.acquire()
         self.render_event.set()
+
+
+def map_song(
+    slot: sunvox.api.Slot,
+    pool: BufferPool | None = None,
+) -> tuple[TimeMap, SongSignature]:
+    new_map = TimeMap.from_slot(slot, pool)
+    return new_map, song_signature(slot, new_map.lines)
+
+
+@attrs.define
+class SongMapped:
+    """A song's time map and signature.
+
+    `time_map` may come from a BufferPool: subscribers that keep it past the
+    callback retain it, and release it once they are done.
+    """
+
+    song_path: Path
+    handle: SongHandle
+    time_map: TimeMap = attrs.field(repr=False)
+    signature: SongSignature = attrs.field(repr=False)
+    map_seconds: float = 0.0
+
+
+SONG_MAPPED = Topic(Key("song", "mapped"), SongMapped)
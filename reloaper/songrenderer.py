@@ -1,6 +1,10 @@
 import asyncio
-import ctypes
+import contextlib
+import functools
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -8,7 +12,23 @@ import attrs
 import numpy as np
 
 import sunvox.api
-from reloaper.pubsub import hub, Key
+from reloaper.audiodiff import changed_frame_ranges, frame_ranges_to_lines
+from reloaper.bufferpool import BufferPool, shared_pool
+from reloaper.engine import RenderCancelled, play_from, render_chunks
+from reloaper.export import export_song
+from reloaper.metrics import METRICS_RENDER, render_metrics, reset_peak_memory
+from reloaper.parallel import ParallelRenderer
+from reloaper.peaks import PeakPyramid, build_peaks
+from reloaper.loopregion import LOOP_CHANGED, LoopChanged
+from reloaper.pubsub import Key, Topic
+from reloaper.preview import PreviewRenderer, render_preview, stretch
+from reloaper.rendercache import CacheKey, RenderCache
+from reloaper.scheduler import RenderScheduler
+from reloaper.songchange import Work
+from reloaper.songmapper import SONG_MAPPED, SongMapped
+from reloaper.songsignature import SongSignature, first_changed_line
+from reloaper.songwatcher import SONG_CHANGED, SongChanged
+from reloaper.timemap import TimeMap
 
 log = logging.getLogger(__name__)
 
@@ -16,40 +36,828 @@ log = logging.getLogger(__name__)
 @attrs.define
 class SongRenderer:
     song_path: Path
+    freq: int = 44100
+    dtype: np.dtype = attrs.field(default=np.dtype(np.int16), converter=np.dtype)
+    chunk_size: int = 4096
+    progress_interval: float = 0.25
+    preroll_lines: int = 16
+    cache: RenderCache | None = None
+    parallel: ParallelRenderer | None = None
+    export_path: Path | None = None
+    diff_block_frames: int = 1024
+    loop_start_line: int | None = None
+    loop_length_lines: int | None = None
+    scheduler: RenderScheduler | None = None
+    # Parallel renders take their permits from here instead, when given.
+    parallel_scheduler: RenderScheduler | None = None
+    preview: PreviewRenderer | None = None
+    pool: BufferPool = shared_pool
 
     latest_audio: np.ndarray | None = None
     latest_audio_timestamp: datetime | None = None
+    latest_map: TimeMap | None = None
+    latest_signature: SongSignature | None = None
+    latest_hash: str | None = None
+    latest_peaks: PeakPyramid | None = None
     render_event: asyncio.Event = attrs.field(factory=asyncio.Event)
+    pending: SongMapped | None = None
+    rendering: bool = False
+    generation: int = 0
+    cancel_event: threading.Event = attrs.field(factory=threading.Event)
+    executor: ThreadPoolExecutor = attrs.field(
+        factory=lambda: ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="SongRenderer",
+        )
+    )
+    parallel_executor: ThreadPoolExecutor = attrs.field(
+        factory=lambda: ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="ParallelRender",
+        )
+    )
+    # Cache writes go to their own thread so they never hold up a render.
+    cache_executor: ThreadPoolExecutor = attrs.field(
+        factory=lambda: ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="RenderCache",
+        )
+    )
 
     def __attrs_post_init__(self):
-        hub.add_subscriber(Key("song", "changed"), self.trigger_render)
+        SONG_CHANGED.subscribe(self.load_cached)
+        SONG_MAPPED.subscribe(self.trigger_render)
+        LOOP_CHANGED.subscribe(self.on_loop_changed)
 
     async def render_loop(self):
         log.debug("Starting SongRenderer render loop")
+        loop = asyncio.get_running_loop()
         while True:
             await self.render_event.wait()
             self.render_event.clear()
-            with sunvox.api.Slot(self.song_path) as slot:
-                song_length_frames = slot.get_song_length_frames()
-                log.debug("Rendering %r frames of song audio...", song_length_frames)
-                current_frame = 0
-                buffer_size = 4096
-                buffer = np.zeros((buffer_size, 2), np.int16)
-                new_audio = np.ndarray((song_length_frames, 2), np.int16)
-                while current_frame < song_length_frames:
-                    sunvox.api.audio_callback(
-                        buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
-                        buffer_size,
-                        0,
-                        sunvox.api.get_ticks(),
+            mapped, self.pending = self.pending, None
+            # The render reads from the previous audio and is compared against
+            # it afterwards, so it is kept even if latest_audio moves on.
+            previous_audio = self.pool.retain(self.latest_audio)
+            try:
+                await self.render_mapped(mapped, previous_audio, loop)
+            except Exception:
+                # A song that fails to render is rendered again when it changes.
+                log.exception("Could not render %s", self.song_path)
+            finally:
+                # trigger_render retained the map; latest_map holds its own
+                # reference if the map was adopted.
+                self.pool.release(previous_audio)
+                self.pool.release(mapped.time_map)
+
+    async def render_mapped(
+        self,
+        mapped: SongMapped,
+        previous_audio: np.ndarray | None,
+        loop: asyncio.AbstractEventLoop,
+    ):
+        handle = mapped.handle
+        if self.export_path is not None:
+            await self.export(mapped, loop)
+            return
+        if handle.content_hash == self.latest_hash:
+            log.debug("Song audio is already rendered; skipping render")
+            handle.release()
+            self.latest_signature = mapped.signature
+            return
+        first_line = self.first_line_to_render(mapped)
+        if first_line is None:
+            log.debug("Song audio is unchanged; skipping render")
+            handle.release()
+            self.latest_audio_timestamp = handle.timestamp
+            self.latest_hash = handle.content_hash
+            return
+        generation = self.generation
+        preview_task = None
+        if self.preview is not None and not self.loop_length_lines:
+            # While looping, the loop is rendered first anyway, and a draft
+            # of the rest of the song would not be heard.
+            preview_task = asyncio.create_task(
+                self.render_preview(
+                    mapped,
+                    handle.slot.get_song_length_frames(),
+                    first_line,
+                    previous_audio,
+                )
+            )
+        try:
+            async with self.render_permit(handle.timestamp, first_line):
+                if self.pending is not None:
+                    log.debug("Skipping render; a newer version is pending")
+                    return
+                self.cancel_event.clear()
+                self.rendering = True
+                reset_peak_memory()
+                started = time.perf_counter()
+                new_audio, frames_rendered = await loop.run_in_executor(
+                    self.render_executor(first_line),
+                    self.render,
+                    handle.slot,
+                    mapped.time_map,
+                    first_line,
+                    previous_audio,
+                    loop,
+                    handle.content_hash,
+                )
+        except RenderCancelled:
+            log.debug("Render cancelled; a newer version of the song is pending")
+            return
+        finally:
+            self.rendering = False
+            handle.release()
+            if preview_task is not None:
+                preview_task.cancel()
+        render_seconds = time.perf_counter() - started
+        try:
+            if generation != self.generation:
+                log.debug("Discarding render superseded by a cached version")
+                return
+            previous_peaks = self.latest_peaks
+            self.replace_latest(new_audio, mapped.time_map)
+            self.latest_audio_timestamp = handle.timestamp
+            self.latest_signature = mapped.signature
+            self.latest_hash = handle.content_hash
+            self.latest_peaks = None
+            log.debug("latest_audio_timestamp %r", self.latest_audio_timestamp)
+            self.publish_rendered()
+            METRICS_RENDER.publish(
+                render_metrics(
+                    song_path=self.song_path,
+                    content_hash=handle.content_hash,
+                    freq=self.freq,
+                    load_seconds=handle.load_seconds,
+                    map_seconds=mapped.map_seconds,
+                    render_seconds=render_seconds,
+                    frames_rendered=frames_rendered,
+                    song_length_frames=len(new_audio),
+                ),
+            )
+            frame_ranges, peaks = await loop.run_in_executor(
+                self.executor,
+                self.summarize,
+                previous_audio,
+                previous_peaks,
+                new_audio,
+                max(len(new_audio) - frames_rendered, 0),
+            )
+            if generation != self.generation:
+                return
+            if frame_ranges is not None:
+                AUDIO_DIFF.publish(
+                    AudioDiff(
+                        song_path=self.song_path,
+                        content_hash=handle.content_hash,
+                        frame_ranges=frame_ranges,
+                        line_ranges=frame_ranges_to_lines(
+                            frame_ranges, mapped.time_map
+                        ),
+                    ),
+                )
+            self.latest_peaks = peaks
+            self.publish_peaks()
+            if self.cache is not None:
+                self.store_cached(
+                    handle.content_hash, new_audio, mapped.time_map, peaks
+                )
+        finally:
+            self.pool.release(new_audio)
+
+    def store_cached(
+        self,
+        content_hash: str,
+        audio: np.ndarray,
+        time_map: TimeMap,
+        peaks: PeakPyramid | None,
+    ):
+        # Nothing waits for the write, so the buffers are held until it is done.
+        self.pool.retain(audio)
+        self.pool.retain(time_map)
+        future = self.cache_executor.submit(
+            self.cache.store,
+            self.cache_key(content_hash),
+            audio,
+            time_map,
+            peaks,
+        )
+
+        def stored(future):
+            self.pool.release(audio)
+            self.pool.release(time_map)
+            error = future.exception()
+            if error is not None:
+                log.error("Could not store render in cache", exc_info=error)
+
+        future.add_done_callback(stored)
+
+    async def render_preview(
+        self,
+        mapped: SongMapped,
+        song_length_frames: int,
+        first_line: int,
+        previous_audio: np.ndarray | None,
+    ):
+        # Cancelled by render_loop as soon as the real render finishes.
+        loop = asyncio.get_running_loop()
+        handle = mapped.handle
+        splice_frame = 0
+        if first_line > 0 and previous_audio is not None:
+            splice_frame = min(
+                mapped.time_map.line_frame(first_line),
+                len(previous_audio),
+            )
+        content_hash = handle.content_hash
+        draft = await loop.run_in_executor(
+            self.preview.executor,
+            render_preview,
+            str(self.song_path),
+            content_hash,
+            self.dtype.name,
+            self.preview.chunk_size,
+        )
+        if draft is None:
+            log.debug("Skipped preview; the song has changed on disk")
+            return
+        self.pool.retain(previous_audio)
+        audio = await asyncio.to_thread(
+            self.stretch_preview,
+            draft,
+            song_length_frames,
+            previous_audio,
+            splice_frame,
+        )
+        log.debug("Publishing preview of %r", content_hash)
+        try:
+            SONG_RENDERED.publish(
+                SongRendered(
+                    song_path=self.song_path,
+                    audio=audio,
+                    time_map=mapped.time_map,
+                    timestamp=handle.timestamp,
+                    preview=True,
+                ),
+            )
+        finally:
+            self.pool.release(audio)
+
+    def stretch_preview(
+        self,
+        draft: np.ndarray,
+        frames: int,
+        previous_audio: np.ndarray | None,
+        splice_frame: int,
+    ) -> np.ndarray:
+        # The thread keeps running if the preview task is cancelled, so it
+        # releases the previous audio itself once it has read it.
+        try:
+            out = self.pool.acquire((frames, 2), draft.dtype)
+            return stretch(draft, frames, previous_audio, splice_frame, out)
+        finally:
+            self.pool.release(previous_audio)
+
+    def render_permit(self, priority: float, first_line: int):
+        scheduler = self.scheduler
+        if self.render_executor(first_line) is self.parallel_executor:
+            scheduler = self.parallel_scheduler or scheduler
+        if scheduler is None:
+            return contextlib.nullcontext()
+        return scheduler.permit(priority)
+
+    def render_executor(self, first_line: int) -> ThreadPoolExecutor:
+        # Parallel renders happen in worker processes, so the thread waiting
+        # for them need not hold up in-process renders of other songs.
+        if first_line == 0 and self.parallel is not None:
+            return self.parallel_executor
+        return self.executor
+
+    def summarize(
+        self,
+        previous_audio: np.ndarray | None,
+        previous_peaks: PeakPyramid | None,
+        new_audio: np.ndarray,
+        start_frame: int,
+    ) -> tuple[np.ndarray | None, PeakPyramid]:
+        # Runs on the executor thread. Frames before start_frame were copied
+        # from the previous render, so the comparison starts there, and only
+        # the peaks covering changed frames are recomputed.
+        if previous_audio is None:
+            return None, build_peaks(new_audio)
+        frame_ranges = changed_frame_ranges(
+            previous_audio,
+            new_audio,
+            self.diff_block_frames,
+            start_frame=start_frame,
+        )
+        if previous_peaks is None:
+            return frame_ranges, build_peaks(new_audio)
+        return frame_ranges, previous_peaks.updated(new_audio, frame_ranges)
+
+    async def export(self, mapped: SongMapped, loop: asyncio.AbstractEventLoop):
+        # Streams the song to export_path instead of keeping it in memory.
+        handle = mapped.handle
+        self.cancel_event.clear()
+        self.rendering = True
+        reset_peak_memory()
+        started = time.perf_counter()
+        try:
+            frames = await loop.run_in_executor(
+                self.executor,
+                functools.partial(
+                    export_song,
+                    handle.slot,
+                    self.export_path,
+                    freq=self.freq,
+                    dtype=self.dtype,
+                    chunk_size=self.chunk_size,
+                    cancel_event=self.cancel_event,
+                ),
+            )
+        except RenderCancelled:
+            log.debug("Export cancelled; a newer version of the song is pending")
+            return
+        finally:
+            self.rendering = False
+            handle.release()
+        render_seconds = time.perf_counter() - started
+        self.latest_hash = handle.content_hash
+        SONG_EXPORTED.publish(
+            SongExported(
+                song_path=self.song_path,
+                export_path=self.export_path,
+                content_hash=handle.content_hash,
+                frames=frames,
+            ),
+        )
+        METRICS_RENDER.publish(
+            render_metrics(
+                song_path=self.song_path,
+                content_hash=handle.content_hash,
+                freq=self.freq,
+                load_seconds=handle.load_seconds,
+                map_seconds=mapped.map_seconds,
+                render_seconds=render_seconds,
+                frames_rendered=frames,
+                song_length_frames=frames,
+            ),
+        )
+
+    def cache_key(self, content_hash: str) -> CacheKey:
+        return CacheKey(
+            content_hash=content_hash,
+            freq=self.freq,
+            render_format=self.dtype.name,
+        )
+
+    def close(self):
+        SONG_CHANGED.unsubscribe(self.load_cached)
+        SONG_MAPPED.unsubscribe(self.trigger_render)
+        LOOP_CHANGED.unsubscribe(self.on_loop_changed)
+        self.cancel_event.set()
+        if self.pending is not None:
+            self.pending.handle.release()
+            self.pool.release(self.pending.time_map)
+            self.pending = None
+        self.render_event.clear()
+        self.replace_latest(None, None)
+        # Lets a cache write in progress finish.
+        self.cache_executor.shutdown(wait=False)
+
+    def load_cached(self, key, message: SongChanged):
+        if message.song_path != self.song_path:
+            return
+        change = message.change
+        if (
+            change is not None
+            and change.work == Work.SKIP
+            and change.old_hash == self.latest_hash
+            and self.pending is None
+        ):
+            log.debug("Only metadata changed; the latest render still applies")
+            self.latest_hash = message.content_hash
+            return
+        if self.cache is None or self.export_path is not None:
+            return
+        cached = self.cache.load(self.cache_key(message.content_hash))
+        if cached is None:
+            return
+        log.debug("Loaded render of %r from cache", message.content_hash)
+        self.generation += 1
+        if self.rendering:
+            self.cancel_event.set()
+        self.replace_latest(cached.audio, cached.time_map)
+        self.latest_audio_timestamp = message.song_path.stat().st_mtime
+        self.latest_signature = None
+        self.latest_hash = message.content_hash
+        self.latest_peaks = cached.peaks
+        self.publish_rendered()
+        if cached.peaks is not None:
+            self.publish_peaks()
+
+    def replace_latest(self, audio: np.ndarray | None, time_map: TimeMap | None):
+        # Pooled buffers go back to the pool once every stage holding the
+        # previous version has released it too.
+        self.pool.retain(audio)
+        self.pool.retain(time_map)
+        self.pool.release(self.latest_audio)
+        self.pool.release(self.latest_map)
+        self.latest_audio = audio
+        self.latest_map = time_map
+
+    def publish_rendered(self):
+        SONG_RENDERED.publish(
+            SongRendered(
+                song_path=self.song_path,
+                audio=self.latest_audio,
+                time_map=self.latest_map,
+                timestamp=self.latest_audio_timestamp,
+            ),
+        )
+
+    def publish_peaks(self):
+        SONG_PEAKS.publish(
+            SongPeaks(
+                song_path=self.song_path,
+                content_hash=self.latest_hash,
+                peaks=self.latest_peaks,
+            ),
+        )
+
+    def first_line_to_render(self, mapped: SongMapped) -> int | None:
+        if self.latest_audio is None:
+            return 0
+        change = mapped.handle.change
+        if change is None or change.old_hash != self.latest_hash:
+            change = None
+        elif change.work == Work.FULL_RENDER:
+            # The classifier already knows where the edit is, as long as it
+            # compared against the version that was rendered last.
+            return 0
+        elif change.work == Work.PARTIAL_RENDER:
+            return change.first_line
+        if self.latest_signature is None:
+            return 0
+        first_line = first_changed_line(
+            self.latest_map,
+            self.latest_signature,
+            mapped.time_map,
+            mapped.signature,
+        )
+        if change is not None and change.first_line is not None:
+            # A remap can still carry lines the classifier saw change, such
+            # as a muted pattern that also held a speed change.
+            if first_line is None or change.first_line < first_line:
+                first_line = change.first_line
+        return first_line
+
+    def render(
+        self,
+        slot: sunvox.api.Slot,
+        time_map: TimeMap,
+        first_line: int,
+        previous_audio: np.ndarray | None,
+        loop: asyncio.AbstractEventLoop,
+        content_hash: str = "",
+    ) -> tuple[np.ndarray, int]:
+        # Runs on the executor thread. Anything published from here has to be
+        # handed back to the event loop, since the hub is not thread-safe.
+        # Returns the new audio and the number of frames actually rendered.
+        song_length_frames = slot.get_song_length_frames()
+        if first_line == 0 and self.parallel is not None:
+            new_audio = self.parallel.render(
+                self.song_path,
+                time_map,
+                song_length_frames,
+                self.cancel_event,
+                on_segment=lambda audio, start, end: self.publish_chunk(
+                    loop, content_hash, audio, start, end
+                ),
+                content_hash=content_hash or None,
+            )
+            self.publish_progress(loop, song_length_frames, song_length_frames)
+            return new_audio, song_length_frames
+        new_audio = self.pool.acquire((song_length_frames, 2), self.dtype)
+        try:
+            frames_rendered = self.render_into(
+                new_audio,
+                slot,
+                time_map,
+                first_line,
+                previous_audio,
+                loop,
+                content_hash,
+            )
+        except BaseException:
+            self.pool.release(new_audio)
+            raise
+        return new_audio, frames_rendered
+
+    def render_into(
+        self,
+        new_audio: np.ndarray,
+        slot: sunvox.api.Slot,
+        time_map: TimeMap,
+        first_line: int,
+        previous_audio: np.ndarray | None,
+        loop: asyncio.AbstractEventLoop,
+        content_hash: str,
+    ) -> int:
+        song_length_frames = len(new_audio)
+        start_line = splice_frame = 0
+        if first_line > 0:
+            start_line = max(first_line - self.preroll_lines, 0)
+            splice_frame = min(
+                time_map.line_frame(first_line),
+                len(previous_audio),
+            )
+        start_frame = time_map.line_frame(start_line)
+        if splice_frame < start_frame:
+            # The previous render is too short to cover the pre-roll.
+            start_line = start_frame = splice_frame = 0
+        log.debug(
+            "Rendering %r of %r frames of song audio from line %r...",
+            song_length_frames - start_frame,
+            song_length_frames,
+            start_line,
+        )
+        # Everything before the first changed line comes from the last render,
+        # so consumers can have it straight away.
+        if splice_frame:
+            new_audio[:splice_frame] = previous_audio[:splice_frame]
+            self.publish_chunk(loop, content_hash, new_audio, 0, splice_frame)
+        regions = self.render_regions(
+            time_map,
+            song_length_frames,
+            start_line,
+            splice_frame,
+        )
+        frames_done = splice_frame
+        frames_rendered = 0
+        next_progress = time.monotonic() + self.progress_interval
+        try:
+            for region_index, (preroll_line, begin, end) in enumerate(regions):
+                preroll_frame = min(
+                    time_map.line_frame(preroll_line),
+                    begin,
+                )
+                # Frames rendered during the pre-roll only warm up effect tails,
+                # so they go to a scratch buffer and are thrown away.
+                preroll = self.pool.acquire((begin - preroll_frame, 2), self.dtype)
+                try:
+                    play_from(slot, preroll_line)
+                    for _ in render_chunks(preroll, self.chunk_size):
+                        if self.cancel_event.is_set():
+                            raise RenderCancelled()
+                finally:
+                    self.pool.release(preroll)
+                chunk_start = begin
+                for rendered in render_chunks(new_audio[begin:end], self.chunk_size):
+                    chunk_end = begin + rendered
+                    self.publish_chunk(
+                        loop,
+                        content_hash,
+                        new_audio,
+                        chunk_start,
+                        chunk_end,
                     )
-                    end_frame = min(current_frame + buffer_size, song_length_frames)
-                    copy_size = end_frame - current_frame
-                    new_audio[current_frame:end_frame] = buffer[:copy_size]
-                    current_frame = end_frame
-                self.latest_audio = new_audio
-                self.latest_audio_timestamp = self.song_path.stat().st_mtime
-                log.debug("latest_audio_timestamp %r", self.latest_audio_timestamp)
-
-    def trigger_render(self, key, message):
+                    frames_done += chunk_end - chunk_start
+                    chunk_start = chunk_end
+                    if self.cancel_event.is_set():
+                        raise RenderCancelled()
+                    if time.monotonic() >= next_progress:
+                        self.publish_progress(loop, frames_done, song_length_frames)
+                        next_progress = time.monotonic() + self.progress_interval
+                frames_rendered += end - preroll_frame
+                if region_index == 0 and len(regions) > 1:
+                    self.publish_loop_rendered(loop, content_hash, new_audio, time_map)
+        finally:
+            slot.stop()
+        self.publish_progress(loop, song_length_frames, song_length_frames)
+        return frames_rendered
+
+    def render_regions(
+        self,
+        time_map: TimeMap,
+        song_length_frames: int,
+        start_line: int,
+        splice_frame: int,
+    ) -> list[tuple[int, int, int]]:
+        """Order the frames still to be rendered as (pre-roll line, start, end).
+
+        If a loop region overlaps them, the loop comes first so it can be
+        heard as soon as possible, followed by the frames before and after it.
+        """
+        regions = [(start_line, splice_frame, song_length_frames)]
+        if self.loop_start_line is None or not self.loop_length_lines:
+            return regions
+        loop_end_line = self.loop_start_line + self.loop_length_lines
+        loop_start_frame, loop_end_frame = time_map.line_frames(
+            [self.loop_start_line, loop_end_line]
+        ).tolist()
+        if loop_end_frame <= splice_frame or loop_start_frame >= song_length_frames:
+            return regions
+        if loop_start_frame <= splice_frame:
+            regions = [(start_line, splice_frame, loop_end_frame)]
+        else:
+            regions = [
+                (
+                    max(self.loop_start_line - self.preroll_lines, 0),
+                    loop_start_frame,
+                    loop_end_frame,
+                ),
+                (start_line, splice_frame, loop_start_frame),
+            ]
+        if loop_end_frame < song_length_frames:
+            regions.append(
+                (
+                    max(loop_end_line - self.preroll_lines, 0),
+                    loop_end_frame,
+                    song_length_frames,
+                )
+            )
+        return regions
+
+    def on_loop_changed(self, key, message: LoopChanged):
+        self.loop_start_line = message.start_line
+        self.loop_length_lines = message.length_lines
+
+    def publish_loop_rendered(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        content_hash: str,
+        audio: np.ndarray,
+        time_map: TimeMap,
+    ):
+        # Only the loop region of `audio` is valid at this point.
+        self.publish_held(
+            loop,
+            LOOP_RENDERED,
+            LoopRendered(
+                song_path=self.song_path,
+                content_hash=content_hash,
+                audio=audio,
+                time_map=time_map,
+                start_line=self.loop_start_line,
+                length_lines=self.loop_length_lines,
+            ),
+            audio,
+            time_map,
+        )
+
+    def publish_chunk(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        content_hash: str,
+        audio: np.ndarray,
+        start_frame: int,
+        end_frame: int,
+    ):
+        # The chunk is a view: its frames are not written again until the buffer
+        # is released back to the pool, so consumers that keep it must copy it.
+        self.publish_held(
+            loop,
+            AUDIO_CHUNK,
+            AudioChunk(
+                song_path=self.song_path,
+                content_hash=content_hash,
+                frame_offset=start_frame,
+                audio=audio[start_frame:end_frame],
+                frames_total=len(audio),
+            ),
+            audio,
+        )
+
+    def publish_held(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        topic: Topic,
+        message,
+        *buffers,
+    ):
+        # A cancelled render releases its audio from the executor thread, maybe
+        # before the loop gets to the message, so the pooled buffers the
+        # message refers to are held until it has been delivered.
+        for buffer in buffers:
+            self.pool.retain(buffer)
+
+        def delivered():
+            for buffer in buffers:
+                self.pool.release(buffer)
+
+        topic.publish_threadsafe(loop, message, done=delivered)
+
+    def publish_progress(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        frames_rendered: int,
+        frames_total: int,
+    ):
+        RENDER_PROGRESS.publish_threadsafe(
+            loop,
+            RenderProgress(
+                song_path=self.song_path,
+                frames_rendered=frames_rendered,
+                frames_total=frames_total,
+            ),
+        )
+
+    def trigger_render(self, key, message: SongMapped):
+        if message.song_path != self.song_path:
+            return
+        if self.pending is not None:
+            self.pending.handle.release()
+            self.pool.release(self.pending.time_map)
+        message.handle.acquire()
+        self.pool.retain(message.time_map)
+        self.pending = message
         self.render_event.set()
+        if self.rendering:
+            self.cancel_event.set()
+
+
+@attrs.define
+class SongRendered:
+    """A finished render, or a preview of one.
+
+    `audio` and `time_map` may come from a BufferPool: subscribers that keep
+    them past the callback retain them, and release them once they are done.
+    """
+
+    song_path: Path
+    audio: np.ndarray = attrs.field(repr=False)
+    time_map: TimeMap = attrs.field(repr=False)
+    timestamp: float
+    preview: bool = False
+
+
+@attrs.define
+class LoopRendered:
+    """The loop region of a render in progress, published before the rest.
+
+    Only the frames of the loop starting at `start_line` are valid in `audio`;
+    the complete render follows as SongRendered.
+    """
+
+    song_path: Path
+    content_hash: str
+    audio: np.ndarray = attrs.field(repr=False)
+    time_map: TimeMap = attrs.field(repr=False)
+    start_line: int
+    length_lines: int
+
+
+@attrs.define
+class RenderProgress:
+    song_path: Path
+    frames_rendered: int
+    frames_total: int
+
+
+@attrs.define
+class AudioChunk:
+    song_path: Path
+    content_hash: str
+    frame_offset: int
+    audio: np.ndarray = attrs.field(repr=False)
+    frames_total: int
+
+
+@attrs.define
+class SongExported:
+    song_path: Path
+    export_path: Path
+    content_hash: str
+    frames: int
+
+
+@attrs.define
+class SongPeaks:
+    song_path: Path
+    content_hash: str
+    peaks: PeakPyramid = attrs.field(repr=False)
+
+
+@attrs.define
+class AudioDiff:
+    """Where the latest render differs from the one before it.
+
+    Both arrays have one [start, end) row per changed region; frame ranges
+    are in frames of the new render and line ranges in song lines.
+    """
+
+    song_path: Path
+    content_hash: str
+    frame_ranges: np.ndarray
+    line_ranges: np.ndarray
+
+
+SONG_RENDERED = Topic(Key("song", "rendered"), SongRendered)
+LOOP_RENDERED = Topic(Key("loop", "rendered"), LoopRendered)
+RENDER_PROGRESS = Topic(Key("render", "progress"), RenderProgress)
+AUDIO_CHUNK = Topic(Key("audio", "chunk"), AudioChunk)
+SONG_EXPORTED = Topic(Key("song", "exported"), SongExported)
+SONG_PEAKS = Topic(Key("song", "peaks"), SongPeaks)
+AUDIO_DIFF = Topic(Key("audio", "diff"), AudioDiff)
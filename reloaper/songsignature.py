@@ -0,0 +1,186 @@
+import ctypes
+import functools
+import hashlib
+import logging
+
+import attrs
+import numpy as np
+
+import sunvox.api
+import sunvox.dll
+from reloaper.timemap import TimeMap
+
+log = logging.getLogger(__name__)
+
+# Per-track multipliers used to fold a line of pattern events into one word.
+# Large odd constants keep the fold sensitive to which track an event is in.
+TRACK_MIX = np.uint64(0x9E3779B97F4A7C15)
+PATTERN_MIX = 0xC2B2AE3D27D4EB4F
+UINT64_MASK = 0xFFFFFFFFFFFFFFFF
+
+# Module types whose sound depends on data the library API cannot read, such
+# as samples or an embedded project.
+UNSIGNED_MODULE_TYPES = {"Sampler", "MetaModule", "Vorbis player", "SpectraVoice"}
+
+# Curves the library can read, by module type, with the number of items in each.
+MODULE_CURVES = {
+    "MultiSynth": (128, 257, 128),
+    "WaveShaper": (256,),
+    "MultiCtl": (257,),
+    "Analog generator": (32,),
+    "Generator": (32,),
+    "FMX": (256,),
+}
+
+
+@attrs.define(eq=False)
+class SongSignature:
+    lines: np.ndarray
+    modules: bytes
+    # False if some module's sound cannot be signed, in which case an unchanged
+    # signature does not mean unchanged audio.
+    complete: bool = True
+
+
+def song_signature(slot: sunvox.api.Slot, song_length_lines: int) -> SongSignature:
+    modules, complete = module_signature(slot)
+    return SongSignature(
+        lines=line_signatures(slot, song_length_lines),
+        modules=modules,
+        complete=complete,
+    )
+
+
+def line_signatures(slot: sunvox.api.Slot, song_length_lines: int) -> np.ndarray:
+    signatures = np.zeros(song_length_lines, np.uint64)
+    for pat_num in range(slot.get_number_of_patterns()):
+        pat_lines = slot.get_pattern_lines(pat_num)
+        if pat_lines <= 0:
+            continue
+        pat_tracks = slot.get_pattern_tracks(pat_num)
+        pat_x = slot.get_pattern_x(pat_num)
+        pat_y = slot.get_pattern_y(pat_num)
+        first = max(pat_x, 0)
+        last = min(pat_x + pat_lines, song_length_lines)
+        if first >= last:
+            continue
+        # Each sunvox_note is 8 bytes, so a whole pattern can be viewed as a
+        # (lines, tracks) array of uint64 words without copying.
+        data = np.ctypeslib.as_array(
+            ctypes.cast(
+                slot.get_pattern_data(pat_num),
+                ctypes.POINTER(ctypes.c_uint64),
+            ),
+            shape=(pat_lines, pat_tracks),
+        )
+        track_mix = TRACK_MIX * np.arange(1, pat_tracks + 1, dtype=np.uint64)
+        folded = (data[first - pat_x : last - pat_x] * track_mix).sum(
+            axis=1,
+            dtype=np.uint64,
+        )
+        # A negative value only queries the mute state.
+        muted = slot.pattern_mute(pat_num, -1) == 1
+        pattern_key = ((pat_y & 0xFFFFFFFF) << 17) | (muted << 16) | pat_tracks
+        folded ^= np.uint64((PATTERN_MIX * pattern_key) & UINT64_MASK)
+        signatures[first:last] += folded
+    return signatures
+
+
+def module_signature(slot: sunvox.api.Slot) -> tuple[bytes, bool]:
+    """Digest everything about the modules that the library can read.
+
+    Also returns whether that covers everything that affects their sound.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    complete = True
+    for mod_num in range(slot.get_number_of_modules()):
+        flags = slot.get_module_flags(mod_num)
+        if not flags & sunvox.api.MODULE.FLAG_EXISTS:
+            continue
+        module_type = slot.get_module_type(mod_num)
+        if module_type in UNSIGNED_MODULE_TYPES:
+            complete = False
+        ctls = [
+            slot.get_module_ctl_value(mod_num, ctl_num, 0)
+            for ctl_num in range(slot.get_number_of_module_ctls(mod_num))
+        ]
+        digest.update(
+            repr(
+                (
+                    mod_num,
+                    flags,
+                    module_type,
+                    slot.get_module_name(mod_num),
+                    # Packs the relative note along with the finetune.
+                    slot.get_module_finetune(mod_num),
+                    module_links(slot, mod_num, flags),
+                    ctls,
+                )
+            ).encode()
+        )
+        for curve_num, length in enumerate(MODULE_CURVES.get(module_type, ())):
+            curve = (ctypes.c_float * length)()
+            # Slot.module_curve does not pass its arguments through, so this
+            # calls the library directly.
+            slot.process.module_curve(slot.number, mod_num, curve_num, curve, length, 0)
+            digest.update(bytes(curve))
+    return digest.digest(), complete
+
+
+def module_links(
+    slot: sunvox.api.Slot,
+    mod_num: int,
+    flags: int,
+) -> tuple[list[int], list[int]]:
+    """The modules linked to the inputs and outputs of a module; -1 if empty."""
+    module = sunvox.api.MODULE
+    input_count = (flags & module.INPUTS_MASK) >> module.INPUTS_OFF
+    output_count = (flags & module.OUTPUTS_MASK) >> module.OUTPUTS_OFF
+    inputs = link_function("sv_get_module_inputs")(slot.number, mod_num)
+    outputs = link_function("sv_get_module_outputs")(slot.number, mod_num)
+    return inputs[:input_count], outputs[:output_count]
+
+
+@functools.cache
+def link_function(name: str):
+    # The library returns pointers to int arrays, but the wrapper declares
+    # them as returning an int, which truncates them on 64-bit platforms.
+    library = sunvox.dll._s
+    function = library._FuncPtr((name, library))
+    function.argtypes = [ctypes.c_int, ctypes.c_int]
+    function.restype = ctypes.POINTER(ctypes.c_int)
+    return function
+
+
+def first_changed_line(
+    old_map: TimeMap,
+    old_signature: SongSignature,
+    new_map: TimeMap,
+    new_signature: SongSignature,
+) -> int | None:
+    """Find the first line whose audio may differ between two versions of a song.
+
+    Returns None if nothing that affects the audio has changed, and 0 if either
+    signature is incomplete.
+    """
+    if not (old_signature.complete and new_signature.complete):
+        return 0
+    if old_signature.modules != new_signature.modules:
+        return 0
+    common = min(old_map.lines, new_map.lines)
+    candidates = []
+    if old_map.lines != new_map.lines:
+        candidates.append(common)
+    (line_diffs,) = np.nonzero(
+        old_signature.lines[:common] != new_signature.lines[:common]
+    )
+    if len(line_diffs):
+        candidates.append(int(line_diffs[0]))
+    (map_diffs,) = np.nonzero(old_map.starts[:common] != new_map.starts[:common])
+    if len(map_diffs):
+        # The map holds the frame at the *start* of each line, so a difference
+        # at line N means line N - 1 changed length.
+        candidates.append(max(int(map_diffs[0]) - 1, 0))
+    if not candidates:
+        return None
+    return min(candidates)
@@ -1,11 +1,17 @@
+import asyncio
+import hashlib
 import logging
+from collections.abc import Callable
 from pathlib import Path
 
 import attrs
 import contextlib
+from rv.api import Project
 from watchfiles import awatch, Change
 
-from reloaper.pubsub import Key, hub
+from reloaper.pubsub import Key, Topic
+from reloaper.scheduler import expand_song_paths, song_root
+from reloaper.songchange import SongChange, classify_change, read_song
 
 log = logging.getLogger(__name__)
 
@@ -13,31 +19,157 @@ log = logging.getLogger(__name__)
 @attrs.define
 class SongWatcher:
     song_path: Path
+    debounce_ms: int = 200
+    classify: bool = True
+    # When False, a SongDirectoryWatcher watching many songs at once calls
+    # notify() instead of the watcher running a watch of its own.
+    watch_directory: bool = True
+
+    latest_hash: str | None = None
+    latest_project: Project | None = None
+    changed: asyncio.Event = attrs.field(factory=asyncio.Event)
 
     async def watch(self):
         log.debug("Watching %r", self.song_path)
         log.debug("Initial change to kick off rendering.")
-        self.publish_change()
-        async for changes in self.wrapped_awatch(self.song_path):
-            for change, path in changes:
-                if path != str(self.song_path):
-                    continue
-                if change != Change.modified:
-                    continue
-                self.publish_change()
+        await self.check_change()
+        if not self.watch_directory:
+            while True:
+                await self.changed.wait()
+                self.changed.clear()
+                await self.check_change()
+        # Watch the directory rather than the file itself: editors that save by
+        # writing a temporary file and renaming it over the song replace the
+        # inode, which shows up as Change.added in the parent directory.
+        async for changes in self.wrapped_awatch(self.song_path.parent):
+            if any(change in (Change.added, Change.modified) for change, _ in changes):
+                await self.check_change()
 
     async def wrapped_awatch(self, path):
         with contextlib.suppress(RuntimeError):
-            async for changes in awatch(path):
+            async for changes in awatch(
+                path,
+                watch_filter=self.is_song_path,
+                step=self.debounce_ms,
+                recursive=False,
+            ):
                 yield changes
 
-    def publish_change(self):
-        hub.publish(
-            Key("song", "changed"),
-            SongChanged(song_path=self.song_path),
+    def is_song_path(self, change: Change, path: str) -> bool:
+        return Path(path) == self.song_path
+
+    def notify(self):
+        """Check the song for changes, when not watching it itself."""
+        self.changed.set()
+
+    async def check_change(self):
+        """Publish a change if the song's content differs from the last one seen.
+
+        With `classify` set, both versions are parsed with Radiant Voices off the
+        event loop, and the change says what kind of edit it was.
+        """
+        try:
+            data = self.song_path.read_bytes()
+        except FileNotFoundError:
+            log.debug("%r is missing; waiting for it to be written", self.song_path)
+            return
+        content_hash = data_hash(data)
+        if content_hash == self.latest_hash:
+            log.debug("Content of %r is unchanged", self.song_path)
+            return
+        change = None
+        if self.classify:
+            project = await asyncio.to_thread(read_song, data)
+            if project is not None and self.latest_project is not None:
+                change = await asyncio.to_thread(
+                    classify_change,
+                    self.latest_project,
+                    project,
+                    self.latest_hash,
+                )
+                log.debug("Change classified as %r", change)
+            self.latest_project = project
+        self.publish_change(content_hash, change)
+
+    def publish_change(
+        self,
+        content_hash: str | None = None,
+        change: SongChange | None = None,
+    ):
+        if content_hash is None:
+            # Unclassified, e.g. a forced render: the next change is compared
+            # against nothing rather than a version that may not be current.
+            try:
+                content_hash = file_hash(self.song_path)
+            except FileNotFoundError:
+                log.debug("%r is missing", self.song_path)
+                return
+            self.latest_project = None
+        self.latest_hash = content_hash
+        SONG_CHANGED.publish(
+            SongChanged(
+                song_path=self.song_path,
+                content_hash=content_hash,
+                change=change,
+            ),
         )
 
 
+@attrs.define
+class SongDirectoryWatcher:
+    """Watch every song named by a directory or glob pattern with one watch.
+
+    A change to a song is passed on to its SongWatcher. Songs that match the
+    pattern but have no watcher yet, including ones added later, are passed
+    to `add_song`, which returns the watcher to notify from then on.
+    """
+
+    pattern: str
+    add_song: Callable[[Path], SongWatcher]
+    debounce_ms: int = 200
+
+    watchers: dict[Path, SongWatcher] = attrs.field(factory=dict)
+
+    async def watch(self):
+        self.add_new_songs()
+        log.info("Watching %d songs", len(self.watchers))
+        async for changes in awatch(
+            song_root(self.pattern),
+            step=self.debounce_ms,
+            recursive="**" in self.pattern,
+        ):
+            paths = {
+                Path(path).resolve()
+                for change, path in changes
+                if change in (Change.added, Change.modified)
+            }
+            for path in paths:
+                watcher = self.watchers.get(path)
+                if watcher is not None:
+                    watcher.notify()
+            if not paths <= self.watchers.keys():
+                self.add_new_songs()
+
+    def add_new_songs(self):
+        for song_path in expand_song_paths(self.pattern):
+            if song_path not in self.watchers:
+                log.info("Watching %s", song_path)
+                self.watchers[song_path] = self.add_song(song_path)
+
+
+def data_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    return data_hash(path.read_bytes())
+
+
 @attrs.define
 class SongChanged:
     song_path: Path
+    content_hash: str
+    change: SongChange | None = None
+
+
+SONG_CHANGED = Topic(Key("song", "changed"), SongChanged)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from reloaper.audiodiff import changed_blocks, changed_frame_ranges
+
+
+def audio(frames):
+    return np.zeros((frames, 2), np.int16)
+
+
+def test_identical_audio_has_no_changes():
+    assert changed_frame_ranges(audio(5000), audio(5000), 1024).shape == (0, 2)
+
+
+def test_changes_are_block_aligned_and_merged():
+    old = audio(8192)
+    new = old.copy()
+    new[1500] = 1
+    new[2100, 1] = 1
+    new[7000] = 1
+    ranges = changed_frame_ranges(old, new, 1024)
+    assert ranges.tolist() == [[1024, 3072], [6144, 7168]]
+
+
+def test_last_partial_block_is_clamped():
+    old = audio(2500)
+    new = old.copy()
+    new[2400] = 1
+    assert changed_frame_ranges(old, new, 1024).tolist() == [[2048, 2500]]
+
+
+def test_longer_song_adds_its_tail():
+    old = audio(3000)
+    new = audio(5000)
+    assert changed_frame_ranges(old, new, 1024).tolist() == [[3000, 5000]]
+
+
+def test_shorter_song_reports_the_lost_frames():
+    old = audio(5000)
+    new = audio(3000)
+    assert changed_frame_ranges(old, new, 1024).tolist() == [[3000, 5000]]
+
+
+def test_change_at_the_end_joins_the_tail():
+    old = audio(3000)
+    new = audio(4000)
+    new[2500] = 1
+    assert changed_frame_ranges(old, new, 1024).tolist() == [[2048, 4000]]
+
+
+def test_frames_before_start_frame_are_not_compared():
+    old = audio(4096)
+    new = old.copy()
+    new[10] = 1
+    new[3000] = 1
+    ranges = changed_frame_ranges(old, new, 1024, start_frame=2048)
+    assert ranges.tolist() == [[2048, 3072]]
+
+
+def test_comparison_spans_several_slabs(monkeypatch):
+    monkeypatch.setattr("reloaper.audiodiff.SLAB_FRAMES", 2048)
+    old = audio(10_000)
+    new = old.copy()
+    new[[100, 5000, 9999]] = 1
+    changed = changed_blocks(old, new, 1000)
+    assert np.flatnonzero(changed).tolist() == [0, 5, 9]
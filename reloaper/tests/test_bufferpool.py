@@ -0,0 +1,94 @@
+import gc
+
+import attrs
+import numpy as np
+
+from reloaper.bufferpool import BufferPool, array_base, size_class
+
+
+def test_size_classes_round_up_by_at_most_a_quarter():
+    assert [size_class(n) for n in (1, 4, 5, 8, 9, 12, 13, 100)] == [
+        4,
+        4,
+        5,
+        8,
+        10,
+        12,
+        14,
+        112,
+    ]
+    for length in range(1, 5000):
+        assert length <= size_class(length) <= max(4, length * 1.25)
+
+
+def test_released_buffer_is_reused():
+    pool = BufferPool()
+    first = pool.acquire((1000, 2), np.int16)
+    assert first.shape == (1000, 2)
+    base = array_base(first)
+    pool.release(first)
+    second = pool.acquire((990, 2), np.int16)
+    assert array_base(second) is base
+    assert second.shape == (990, 2)
+
+
+def test_retained_buffer_is_not_reused_until_every_holder_releases():
+    pool = BufferPool()
+    array = pool.acquire((100,), np.float32)
+    pool.retain(array)
+    pool.release(array)
+    other = pool.acquire((100,), np.float32)
+    assert array_base(other) is not array_base(array)
+    pool.release(array)
+    again = pool.acquire((100,), np.float32)
+    assert array_base(again) is array_base(array)
+
+
+def test_buffers_are_kept_apart_by_dtype_and_shape():
+    pool = BufferPool()
+    array = pool.acquire((100, 2), np.int16)
+    pool.release(array)
+    assert array_base(pool.acquire((100, 2), np.float32)) is not array_base(array)
+    assert array_base(pool.acquire((100, 3), np.int16)) is not array_base(array)
+
+
+def test_views_and_wrappers_release_their_base():
+    @attrs.frozen
+    class Wrapper:
+        buffer: np.ndarray
+
+    pool = BufferPool()
+    array = pool.acquire((100, 2), np.int16)
+    pool.retain(array[10:20])
+    pool.retain(Wrapper(array.reshape(-1)))
+    pool.release(array)
+    pool.release(array[:5])
+    assert pool.free == {}
+    pool.release(Wrapper(array))
+    assert array_base(pool.acquire((100, 2), np.int16)) is array_base(array)
+
+
+def test_foreign_arrays_and_none_are_ignored():
+    pool = BufferPool()
+    array = np.zeros(10)
+    assert pool.retain(array) is array
+    pool.release(array)
+    pool.retain(None)
+    pool.release(None)
+    assert pool.free == {} and pool.lent == {}
+
+
+def test_idle_buffers_are_capped():
+    pool = BufferPool(max_idle=1)
+    arrays = [pool.acquire((64,), np.int16) for _ in range(3)]
+    for array in arrays:
+        pool.release(array)
+    assert sum(len(buffers) for buffers in pool.free.values()) == 1
+
+
+def test_dropped_buffer_is_forgotten():
+    pool = BufferPool()
+    array = pool.acquire((64,), np.int16)
+    del array
+    gc.collect()
+    assert pool.lent == {}
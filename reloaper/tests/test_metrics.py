@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from reloaper.metrics import (
+    METRICS_RENDER,
+    MetricsFormat,
+    MetricsWriter,
+    render_metrics,
+)
+
+
+def metrics(song, render_seconds):
+    return render_metrics(
+        song_path=Path(song),
+        content_hash="hash",
+        freq=100,
+        load_seconds=0.0,
+        map_seconds=0.0,
+        render_seconds=render_seconds,
+        frames_rendered=1000,
+        song_length_frames=1000,
+    )
+
+
+def test_prometheus_snapshot_keeps_every_song(tmp_path):
+    path = tmp_path / "reloaper.prom"
+    writer = MetricsWriter(path=path, format=MetricsFormat.prometheus)
+    try:
+        METRICS_RENDER.publish(metrics("a.sunvox", 1.0))
+        METRICS_RENDER.publish(metrics("b.sunvox", 2.0))
+        METRICS_RENDER.publish(metrics("a.sunvox", 4.0))
+    finally:
+        METRICS_RENDER.unsubscribe(writer.write)
+    lines = path.read_text().splitlines()
+    assert lines.count("# TYPE reloaper_render_seconds gauge") == 1
+    assert 'reloaper_render_seconds{song="a.sunvox"} 4.0' in lines
+    assert 'reloaper_render_seconds{song="b.sunvox"} 2.0' in lines
+    assert 'reloaper_realtime_factor{song="b.sunvox"} 5.0' in lines
+    assert len([line for line in lines if "render_seconds{" in line]) == 2
+
+
+def test_jsonl_appends_every_render(tmp_path):
+    path = tmp_path / "reloaper.jsonl"
+    writer = MetricsWriter(path=path)
+    try:
+        METRICS_RENDER.publish(metrics("a.sunvox", 1.0))
+        METRICS_RENDER.publish(metrics("a.sunvox", 2.0))
+    finally:
+        METRICS_RENDER.unsubscribe(writer.write)
+    assert len(path.read_text().splitlines()) == 2
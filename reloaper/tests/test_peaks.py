@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from reloaper.peaks import build_peaks, peaks_arrays, peaks_from_arrays
+
+
+def random_audio(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-30000, 30000, size=(frames, 2)).astype(np.int16)
+
+
+def assert_same_peaks(actual, expected):
+    assert actual.frames == expected.frames
+    assert len(actual.levels) == len(expected.levels)
+    for got, want in zip(actual.levels, expected.levels):
+        assert got.block_frames == want.block_frames
+        np.testing.assert_array_equal(got.min, want.min)
+        np.testing.assert_array_equal(got.max, want.max)
+        np.testing.assert_allclose(got.sum_squares, want.sum_squares)
+
+
+def test_levels_cover_the_song():
+    audio = random_audio(10_000)
+    peaks = build_peaks(audio, base_block_frames=256, factor=4)
+    assert [len(level.min) for level in peaks.levels] == [40, 10, 3, 1]
+    top = peaks.levels[-1]
+    np.testing.assert_array_equal(top.min[0], audio.min(axis=0))
+    np.testing.assert_array_equal(top.max[0], audio.max(axis=0))
+
+
+@pytest.mark.parametrize("new_frames", [10_000, 9_000, 12_345])
+def test_updated_matches_a_full_build(new_frames):
+    old = random_audio(10_000)
+    new = random_audio(new_frames, seed=1)
+    new[:3000] = old[:3000]
+    peaks = build_peaks(old, base_block_frames=256, factor=4)
+    changed = np.array([[3000, new_frames]])
+    if new_frames < len(old):
+        changed = np.array([[3000, len(old)]])
+    updated = peaks.updated(new, changed)
+    assert_same_peaks(updated, build_peaks(new, base_block_frames=256, factor=4))
+
+
+def test_updated_leaves_the_original_untouched():
+    old = random_audio(4096)
+    peaks = build_peaks(old, base_block_frames=256, factor=4)
+    before = peaks.levels[0].max.copy()
+    new = old.copy()
+    new[100] = 32000
+    peaks.updated(new, np.array([[0, 256]]))
+    np.testing.assert_array_equal(peaks.levels[0].max, before)
+
+
+def test_arrays_round_trip():
+    peaks = build_peaks(random_audio(5000), base_block_frames=128, factor=2)
+    assert_same_peaks(peaks_from_arrays(peaks_arrays(peaks)), peaks)
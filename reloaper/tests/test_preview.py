@@ -0,0 +1,35 @@
+import numpy as np
+
+from reloaper.preview import stretch
+
+
+def ramp(frames):
+    return np.repeat(np.arange(frames, dtype=np.int16)[:, None], 2, axis=1)
+
+
+def test_stretch_repeats_draft_frames():
+    audio = stretch(ramp(4), 8)
+    assert audio[:, 0].tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+
+
+def test_stretch_can_shrink():
+    audio = stretch(ramp(8), 4)
+    assert audio[:, 1].tolist() == [0, 2, 4, 6]
+
+
+def test_stretch_keeps_the_unchanged_start_of_the_previous_render():
+    previous = np.full((8, 2), 100, np.int16)
+    audio = stretch(ramp(4), 8, previous_audio=previous, splice_frame=3)
+    assert audio[:, 0].tolist() == [100, 100, 100, 1, 2, 2, 3, 3]
+
+
+def test_stretch_writes_into_out():
+    out = np.empty((6, 2), np.int16)
+    assert stretch(ramp(3), 6, out=out) is out
+    assert out[:, 0].tolist() == [0, 0, 1, 1, 2, 2]
+
+
+def test_stretch_of_an_empty_draft_is_silent():
+    previous = np.ones((5, 2), np.int16)
+    audio = stretch(ramp(0), 5, previous_audio=previous, splice_frame=2)
+    assert audio[:, 0].tolist() == [1, 1, 0, 0, 0]
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+import attrs
+
+from reloaper.pubsub import Key, Overflow, Topic
+
+
+@attrs.define
+class Message:
+    number: int
+
+
+def test_drop_oldest_keeps_latest_messages():
+    topic = Topic(Key("test", "drop"), Message)
+
+    async def consume():
+        subscription = topic.queue(maxsize=2)
+        try:
+            for number in range(4):
+                topic.publish(Message(number))
+            received = [(await subscription.get()).number for _ in range(2)]
+        finally:
+            subscription.close()
+        return received, subscription.dropped
+
+    assert asyncio.run(consume()) == ([2, 3], 2)
+
+
+def test_publish_wait_blocks_until_there_is_room():
+    topic = Topic(Key("test", "block"), Message)
+
+    async def consume():
+        subscription = topic.queue(maxsize=1, overflow=Overflow.block)
+        try:
+            topic.publish(Message(1))
+            publish = asyncio.create_task(topic.publish_wait(Message(2)))
+            await asyncio.sleep(0)
+            assert not publish.done()
+            first = await subscription.get()
+            await publish
+            second = await subscription.get()
+        finally:
+            subscription.close()
+        return first.number, second.number
+
+    assert asyncio.run(consume()) == (1, 2)
+    assert topic.blocking == []
+
+
+def test_closed_subscription_stops_receiving():
+    topic = Topic(Key("test", "close"), Message)
+
+    async def consume():
+        subscription = topic.queue(maxsize=4)
+        subscription.close()
+        topic.publish(Message(1))
+        return list(subscription.messages)
+
+    assert asyncio.run(consume()) == []
+
+
+def test_done_is_called_once_a_threadsafe_publish_is_delivered():
+    topic = Topic(Key("test", "threadsafe"), Message)
+    events = []
+
+    def received(key, message):
+        events.append(message.number)
+
+    async def publish_from_thread():
+        loop = asyncio.get_running_loop()
+        delivered = asyncio.Event()
+
+        def done():
+            events.append("done")
+            delivered.set()
+
+        thread = threading.Thread(
+            target=topic.publish_threadsafe,
+            args=(loop, Message(1), done),
+        )
+        thread.start()
+        await delivered.wait()
+        thread.join()
+
+    topic.subscribe(received)
+    try:
+        asyncio.run(publish_from_thread())
+    finally:
+        topic.unsubscribe(received)
+    assert events == [1, "done"]
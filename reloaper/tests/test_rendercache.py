@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from reloaper.peaks import build_peaks
+from reloaper.rendercache import CacheKey, RenderCache
+from reloaper.timemap import TimeMap
+
+
+def key(name):
+    return CacheKey(content_hash=name, freq=44100, render_format="int16")
+
+
+def store(cache, name, used):
+    audio = np.zeros((1000, 2), np.int16)
+    time_map = TimeMap(np.array([[0, 500, 1000], [0, 0, 0]], np.int64))
+    cache.store(key(name), audio, time_map, build_peaks(audio))
+    os.utime(cache.entry_path(key(name)), (used, used))
+
+
+def test_round_trip(tmp_path):
+    cache = RenderCache(root=tmp_path)
+    store(cache, "a", 1000)
+    cached = cache.load(key("a"))
+    assert cached.audio.shape == (1000, 2)
+    assert cached.time_map.offsets.tolist() == [0, 500, 1000]
+    assert cached.peaks.frames == 1000
+    assert cache.load(key("missing")) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = RenderCache(root=tmp_path, max_bytes=None)
+    for used, name in enumerate("abc"):
+        store(cache, name, 1000 + used)
+    entry_bytes = sum(f.stat().st_size for f in cache.entry_path(key("a")).iterdir())
+    # Loading "a" makes it the most recently used entry.
+    cache.load(key("a"))
+    cache.max_bytes = entry_bytes * 3
+    store(cache, "d", 2000)
+    assert cache.load(key("b")) is None
+    assert all(cache.load(key(name)) is not None for name in "acd")
+
+
+def test_no_limit(tmp_path):
+    cache = RenderCache(root=tmp_path, max_bytes=0)
+    for used, name in enumerate("abc"):
+        store(cache, name, 1000 + used)
+    assert sorted(path.name[0] for path in tmp_path.iterdir()) == ["a", "b", "c"]
@@ -0,0 +1,127 @@
+import asyncio
+from pathlib import Path
+
+from reloaper.scheduler import (
+    RenderScheduler,
+    expand_song_paths,
+    is_song_pattern,
+    song_root,
+)
+
+
+def test_permits_go_to_the_highest_priority_waiter():
+    scheduler = RenderScheduler(max_renders=1)
+    order = []
+
+    async def render(name, priority):
+        async with scheduler.permit(priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def main():
+        await scheduler.acquire(0)
+        tasks = [
+            asyncio.create_task(render(name, priority))
+            for name, priority in [("old", 1), ("new", 3), ("middle", 2), ("tie", 2)]
+        ]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["new", "middle", "tie", "old"]
+    assert scheduler.running == 0
+
+
+def test_up_to_max_renders_run_at_once():
+    scheduler = RenderScheduler(max_renders=2)
+    running = []
+    peak = 0
+
+    async def render():
+        nonlocal peak
+        async with scheduler.permit(0):
+            running.append(None)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def main():
+        await asyncio.gather(*(render() for _ in range(5)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert scheduler.running == 0
+
+
+def test_cancelled_waiter_does_not_hold_a_permit():
+    scheduler = RenderScheduler(max_renders=1)
+
+    async def main():
+        await scheduler.acquire(0)
+        waiter = asyncio.create_task(scheduler.acquire(5))
+        other = asyncio.create_task(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        scheduler.release()
+        await other
+        assert waiter.cancelled()
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.running == 0
+    assert scheduler.waiting == []
+
+
+def test_permit_granted_while_cancelling_is_given_back():
+    scheduler = RenderScheduler(max_renders=1)
+
+    async def main():
+        await scheduler.acquire(0)
+        waiter = asyncio.create_task(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        # The permit is handed over, and the waiter is cancelled before it
+        # gets to run.
+        scheduler.release()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(main())
+    assert scheduler.running == 0
+
+
+def test_expand_song_paths(tmp_path):
+    tmp_path = tmp_path.resolve()
+    for name in ("b.sunvox", "a.sunvox", "notes.txt"):
+        (tmp_path / name).touch()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "c.sunvox").touch()
+
+    def names(paths):
+        return [path.relative_to(tmp_path).as_posix() for path in paths]
+
+    assert names(expand_song_paths(str(tmp_path))) == ["a.sunvox", "b.sunvox"]
+    assert names(expand_song_paths(f"{tmp_path}/**/*.sunvox")) == [
+        "a.sunvox",
+        "b.sunvox",
+        "sub/c.sunvox",
+    ]
+    assert expand_song_paths(str(tmp_path / "a.sunvox")) == [tmp_path / "a.sunvox"]
+
+
+def test_song_root(tmp_path):
+    assert song_root(str(tmp_path)) == tmp_path
+    assert song_root(f"{tmp_path}/*.sunvox") == tmp_path
+    assert song_root(f"{tmp_path}/**/x*.sunvox") == tmp_path
+    assert song_root(str(tmp_path / "song.sunvox")) == tmp_path
+    assert song_root("*.sunvox") == Path(".")
+
+
+def test_is_song_pattern(tmp_path):
+    (tmp_path / "only.sunvox").touch()
+    assert is_song_pattern(str(tmp_path))
+    # A glob is a pattern however many songs it matches so far.
+    assert is_song_pattern(f"{tmp_path}/*.sunvox")
+    assert is_song_pattern(f"{tmp_path}/missing*.sunvox")
+    assert not is_song_pattern(str(tmp_path / "only.sunvox"))
+    assert not is_song_pattern(str(tmp_path / "missing.sunvox"))
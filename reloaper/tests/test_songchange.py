@@ -0,0 +1,138 @@
+import io
+
+from rv.api import Note, Pattern, Project, m
+from rv.pattern import PatternClone
+
+from reloaper.songchange import (
+    PATTERN_MUTE,
+    PATTERN_SOLO,
+    ChangeKind,
+    Work,
+    classify_change,
+    read_song,
+)
+
+# Sets the BPM to the value of the note.
+SET_BPM = 0x0F
+
+
+def song(
+    *,
+    name="song",
+    bpm=125,
+    volume=80,
+    module_x=128,
+    note_line=5,
+    note=60,
+    effect=0,
+    pattern_x=16,
+    pattern_flags=0,
+    clone_flags=0,
+) -> Project:
+    """A two-pattern song with a clone, read back the way SongWatcher reads it."""
+    project = Project()
+    project.name = name
+    project.initial_bpm = bpm
+    generator = project.new_module(m.AnalogGenerator, x=module_x, y=128)
+    generator.volume = volume
+    project.connect(generator, project.output)
+    first = Pattern(lines=16, tracks=2, x=pattern_x, flags_PFFF=pattern_flags)
+    project.attach_pattern(first)
+    first.data[note_line][0] = Note(
+        note=note,
+        module=generator.index + 1,
+        ctl=effect,
+        val=0x80 if effect else 0,
+        pattern=first,
+    )
+    second = Pattern(lines=16, tracks=2, x=32)
+    project.attach_pattern(second)
+    second.data[0][1] = Note(note=48, module=generator.index + 1, pattern=second)
+    project.attach_pattern(PatternClone(source=0, x=64, flags_PFFF=1 | clone_flags))
+    data = io.BytesIO()
+    project.write_to(data)
+    return read_song(data.getvalue())
+
+
+def change(**edits):
+    return classify_change(song(), song(**edits), "old")
+
+
+def test_unchanged_song_is_skipped():
+    result = change()
+    assert result.kinds == ChangeKind.NONE
+    assert result.work == Work.SKIP
+    assert result.old_hash == "old"
+
+
+def test_metadata_is_skipped():
+    result = change(name="renamed")
+    assert result.kinds == ChangeKind.METADATA
+    assert result.work == Work.SKIP
+
+
+def test_moving_a_module_is_skipped():
+    assert change(module_x=512).work == Work.SKIP
+
+
+def test_note_change_renders_from_its_line():
+    result = change(note=62)
+    assert result.kinds == ChangeKind.PATTERN_DATA
+    assert result.work == Work.PARTIAL_RENDER
+    # Line 5 of the pattern at line 16; the clone at line 64 comes later.
+    assert result.first_line == 21
+
+
+def test_earliest_of_the_old_and_new_line_is_used():
+    result = change(note_line=2)
+    assert result.work == Work.PARTIAL_RENDER
+    assert result.first_line == 18
+
+
+def test_module_change_renders_everything():
+    result = change(volume=40)
+    assert ChangeKind.MODULES in result.kinds
+    assert result.work == Work.FULL_RENDER
+
+
+def test_timing_changes_remap():
+    assert change(bpm=140).work == Work.REMAP
+    assert change(pattern_x=8).work == Work.REMAP
+    assert change(effect=SET_BPM).work == Work.REMAP
+
+
+def test_mute_renders_from_the_muted_pattern():
+    result = change(pattern_flags=PATTERN_MUTE)
+    assert result.kinds == ChangeKind.PATTERN_DATA
+    assert result.work == Work.PARTIAL_RENDER
+    assert result.first_line == 16
+
+
+def test_clone_mute_renders_from_the_clone():
+    result = change(clone_flags=PATTERN_MUTE)
+    assert result.work == Work.PARTIAL_RENDER
+    assert result.first_line == 64
+
+
+def test_solo_renders_from_the_first_pattern():
+    result = classify_change(
+        song(pattern_x=40),
+        song(pattern_x=40, clone_flags=PATTERN_SOLO),
+        "old",
+    )
+    assert result.work == Work.PARTIAL_RENDER
+    assert result.first_line == 32
+
+
+def test_muting_a_speed_change_remaps_but_keeps_the_line():
+    result = classify_change(
+        song(effect=SET_BPM),
+        song(effect=SET_BPM, pattern_flags=PATTERN_MUTE),
+        "old",
+    )
+    assert result.work == Work.REMAP
+    assert result.first_line == 16
+
+
+def test_unreadable_song():
+    assert read_song(b"not a song") is None
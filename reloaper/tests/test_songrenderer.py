@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from reloaper.songrenderer import SongRenderer
+from reloaper.timemap import TimeMap
+
+# 20 lines of 100 frames each.
+SONG_FRAMES = 2000
+
+
+@pytest.fixture
+def time_map():
+    buffer = np.zeros((2, 21), np.int64)
+    buffer[0] = np.arange(21) * 100
+    return TimeMap(buffer=buffer)
+
+
+@pytest.fixture
+def renderer():
+    renderer = SongRenderer(song_path=Path("song.sunvox"), preroll_lines=2)
+    yield renderer
+    renderer.close()
+
+
+def regions(renderer, time_map, loop_start=None, loop_length=None):
+    renderer.loop_start_line = loop_start
+    renderer.loop_length_lines = loop_length
+    # Line 5 changed, so rendering starts at the pre-roll from line 3.
+    return renderer.render_regions(time_map, SONG_FRAMES, 3, 500)
+
+
+def test_no_loop(renderer, time_map):
+    assert regions(renderer, time_map) == [(3, 500, 2000)]
+    assert regions(renderer, time_map, 8, 0) == [(3, 500, 2000)]
+
+
+def test_loop_before_the_splice_point(renderer, time_map):
+    # The loop was not changed, so the previous render still covers it.
+    assert regions(renderer, time_map, 0, 4) == [(3, 500, 2000)]
+
+
+def test_loop_straddling_the_splice_point(renderer, time_map):
+    assert regions(renderer, time_map, 4, 4) == [
+        (3, 500, 800),
+        (6, 800, 2000),
+    ]
+
+
+def test_loop_after_the_splice_point(renderer, time_map):
+    assert regions(renderer, time_map, 10, 4) == [
+        (8, 1000, 1400),
+        (3, 500, 1000),
+        (12, 1400, 2000),
+    ]
+
+
+def test_loop_to_the_end_of_the_song(renderer, time_map):
+    assert regions(renderer, time_map, 16, 4) == [
+        (14, 1600, 2000),
+        (3, 500, 1600),
+    ]
+    # A loop running past the end stops with the song.
+    assert regions(renderer, time_map, 16, 8) == [
+        (14, 1600, 2000),
+        (3, 500, 1600),
+    ]
+
+
+def test_loop_after_the_end_of_the_song(renderer, time_map):
+    assert regions(renderer, time_map, 24, 4) == [(3, 500, 2000)]
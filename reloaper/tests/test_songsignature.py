@@ -0,0 +1,115 @@
+import numpy as np
+
+from reloaper.songsignature import SongSignature, first_changed_line
+from reloaper.timemap import TimeMap
+
+
+def time_map(line_frames):
+    offsets = np.concatenate([[0], np.cumsum(line_frames)])
+    buffer = np.zeros((2, len(offsets)), np.int64)
+    buffer[0] = offsets
+    return TimeMap(buffer=buffer)
+
+
+def signature(lines, modules=b"modules", complete=True):
+    return SongSignature(
+        lines=np.asarray(lines, np.uint64),
+        modules=modules,
+        complete=complete,
+    )
+
+
+def test_unchanged_song():
+    song_map = time_map([100] * 8)
+    lines = np.arange(8)
+    assert (
+        first_changed_line(song_map, signature(lines), song_map, signature(lines))
+        is None
+    )
+
+
+def test_edit_inside_a_pattern():
+    song_map = time_map([100] * 8)
+    old = signature(np.arange(8))
+    new_lines = np.arange(8)
+    new_lines[5] = 99
+    assert first_changed_line(song_map, old, song_map, signature(new_lines)) == 5
+
+
+def test_line_that_changes_length():
+    old_map = time_map([100] * 8)
+    # Line 3 gets slower, so every later line starts later.
+    new_map = time_map([100, 100, 100, 150, 100, 100, 100, 100])
+    lines = signature(np.arange(8))
+    assert first_changed_line(old_map, lines, new_map, lines) == 3
+
+
+def test_moved_pattern():
+    song_map = time_map([100] * 12)
+    old_lines = np.zeros(12)
+    old_lines[2:4] = 7
+    new_lines = np.zeros(12)
+    new_lines[6:8] = 7
+    assert (
+        first_changed_line(
+            song_map, signature(old_lines), song_map, signature(new_lines)
+        )
+        == 2
+    )
+
+
+def test_pattern_moved_past_the_end():
+    old_lines = np.zeros(8)
+    old_lines[2:4] = 7
+    new_lines = np.zeros(12)
+    new_lines[10:12] = 7
+    assert (
+        first_changed_line(
+            time_map([100] * 8),
+            signature(old_lines),
+            time_map([100] * 12),
+            signature(new_lines),
+        )
+        == 2
+    )
+
+
+def test_longer_song_changes_from_the_old_end():
+    lines = np.arange(12)
+    assert (
+        first_changed_line(
+            time_map([100] * 8),
+            signature(lines[:8]),
+            time_map([100] * 12),
+            signature(lines),
+        )
+        == 8
+    )
+
+
+def test_module_change_renders_everything():
+    song_map = time_map([100] * 8)
+    lines = np.arange(8)
+    assert (
+        first_changed_line(
+            song_map,
+            signature(lines),
+            song_map,
+            signature(lines, modules=b"changed"),
+        )
+        == 0
+    )
+
+
+def test_incomplete_signature_renders_everything():
+    song_map = time_map([100] * 8)
+    lines = np.arange(8)
+    assert (
+        first_changed_line(
+            song_map,
+            signature(lines, complete=False),
+            song_map,
+            signature(lines, complete=False),
+        )
+        == 0
+    )
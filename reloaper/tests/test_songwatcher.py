@@ -0,0 +1,51 @@
+import asyncio
+
+import attrs
+
+from reloaper.songwatcher import SongDirectoryWatcher
+
+
+@attrs.define
+class FakeWatcher:
+    notified: asyncio.Event = attrs.field(factory=asyncio.Event)
+
+    def notify(self):
+        self.notified.set()
+
+
+def test_directory_watcher_notifies_and_adds_songs(tmp_path):
+    tmp_path = tmp_path.resolve()
+    old_song = tmp_path / "old.sunvox"
+    new_song = tmp_path / "new.sunvox"
+    old_song.write_bytes(b"old")
+
+    async def main():
+        added = asyncio.Queue()
+
+        def add_song(song_path):
+            added.put_nowait(song_path)
+            return FakeWatcher()
+
+        watcher = SongDirectoryWatcher(
+            pattern=f"{tmp_path}/*.sunvox",
+            add_song=add_song,
+            debounce_ms=20,
+        )
+        task = asyncio.create_task(watcher.watch())
+        try:
+            assert await asyncio.wait_for(added.get(), 5) == old_song
+            # Give the watch time to start before touching the files.
+            await asyncio.sleep(0.5)
+            old_song.write_bytes(b"edited")
+            await asyncio.wait_for(watcher.watchers[old_song].notified.wait(), 5)
+            new_song.write_bytes(b"new")
+            assert await asyncio.wait_for(added.get(), 5) == new_song
+            (tmp_path / "notes.txt").write_text("not a song")
+            await asyncio.sleep(0.2)
+            assert added.empty()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return sorted(watcher.watchers)
+
+    assert asyncio.run(main()) == [new_song, old_song]
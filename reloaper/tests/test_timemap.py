@@ -0,0 +1,92 @@
+import ctypes
+
+import numpy as np
+
+import sunvox.api
+from reloaper.bufferpool import BufferPool
+from reloaper.timemap import TimeMap
+
+
+class FakeSlot:
+    """Answers the time map queries TimeMap.from_slot makes."""
+
+    def __init__(self, frame_counts, speeds, song_length_frames):
+        self.frame_counts = np.asarray(frame_counts, np.uint32)
+        self.speeds = np.asarray(speeds, np.uint32)
+        self.song_length_frames = song_length_frames
+
+    def get_song_length_lines(self):
+        return len(self.frame_counts)
+
+    def get_song_length_frames(self):
+        return self.song_length_frames
+
+    def get_time_map(self, start_line, len, dest, flags):
+        if flags == sunvox.api.TIME_MAP.FRAMECNT:
+            values = self.frame_counts
+        else:
+            values = self.speeds
+        values = values[start_line : start_line + len]
+        ctypes.memmove(dest, values.ctypes.data, values.nbytes)
+        return 0
+
+
+def speed(bpm, tpl):
+    return bpm | (tpl << 16)
+
+
+def test_lines_and_frames():
+    slot = FakeSlot([0, 100, 250, 400], [speed(125, 6)] * 4, 600)
+    time_map = TimeMap.from_slot(slot)
+    assert time_map.lines == 4
+    assert time_map.song_length_frames == 600
+    assert time_map.offsets.tolist() == [0, 100, 250, 400, 600]
+    assert time_map.starts.tolist() == [0, 100, 250, 400]
+    assert time_map.bpm.tolist() == [125] * 4
+    assert time_map.tpl.tolist() == [6] * 4
+
+
+def test_frame_counter_wraparound():
+    # The 32-bit frame counter wraps between lines 1 and 2.
+    start = 2**32 - 150
+    counts = [start, start + 100, (start + 200) % 2**32, (start + 300) % 2**32]
+    time_map = TimeMap.from_slot(FakeSlot(counts, [0] * 4, start + 400))
+    assert time_map.starts.tolist() == [start, start + 100, start + 200, start + 300]
+    assert time_map.line_frame(3) == start + 300
+    assert time_map.frame_line(start + 250) == 2
+
+
+def test_line_frame_lookups_clamp():
+    time_map = TimeMap.from_slot(FakeSlot([0, 100, 250], [0] * 3, 300))
+    assert time_map.line_frame(-5) == 0
+    assert time_map.line_frame(1) == 100
+    assert time_map.line_frame(3) == 300
+    assert time_map.line_frame(10) == 300
+    assert time_map.line_frames(np.array([0, 2, 3, 7])).tolist() == [0, 250, 300, 300]
+
+
+def test_frame_line_lookups():
+    time_map = TimeMap.from_slot(FakeSlot([0, 100, 250], [0] * 3, 300))
+    assert time_map.frame_line(0) == 0
+    assert time_map.frame_line(99) == 0
+    assert time_map.frame_line(100) == 1
+    assert time_map.frame_line(299) == 2
+    assert time_map.frame_line(10_000) == 2
+    assert time_map.frame_line(-1) == 0
+    frames = np.array([0, 150, 250, 260])
+    assert time_map.frame_lines(frames).tolist() == [0, 1, 2, 2]
+
+
+def test_empty_song():
+    time_map = TimeMap.from_slot(FakeSlot([], [], 0))
+    assert time_map.lines == 0
+    assert time_map.song_length_frames == 0
+    assert time_map.frame_line(0) == 0
+
+
+def test_pooled_time_map_returns_its_buffer():
+    pool = BufferPool()
+    time_map = TimeMap.from_slot(FakeSlot([0, 10], [0, 0], 20), pool)
+    assert time_map.offsets.tolist() == [0, 10, 20]
+    pool.release(time_map)
+    assert sum(len(buffers) for buffers in pool.free.values()) == 2
@@ -0,0 +1,116 @@
+import ctypes
+import logging
+
+import attrs
+import numpy as np
+
+import sunvox.api
+from reloaper.bufferpool import BufferPool
+
+log = logging.getLogger(__name__)
+
+# A SPEED time map entry holds the BPM in its low 16 bits and the ticks per
+# line above them.
+BPM_MASK = 0xFFFF
+TPL_SHIFT = 16
+
+
+@attrs.frozen(eq=False)
+class TimeMap:
+    """Where each line of a song starts, and the speed it plays at.
+
+    `buffer` has two int64 rows. The first holds the frame each line starts
+    at, followed by the song length, so line N lasts from offsets[N] to
+    offsets[N + 1]. The second holds the speed at the start of each line as
+    SunVox reports it. Line-to-frame lookups index the first row, and
+    frame-to-line lookups binary search it.
+    """
+
+    buffer: np.ndarray = attrs.field(repr=False)
+
+    @classmethod
+    def from_slot(
+        cls,
+        slot: sunvox.api.Slot,
+        pool: BufferPool | None = None,
+    ) -> "TimeMap":
+        lines = slot.get_song_length_lines()
+        if pool is None:
+            buffer = np.empty((2, lines + 1), np.int64)
+            scratch = np.empty(lines, np.uint32)
+        else:
+            buffer = pool.acquire((2 * (lines + 1),), np.int64).reshape(2, -1)
+            scratch = pool.acquire((lines,), np.uint32)
+        try:
+            offsets, speeds = buffer
+            if lines:
+                read_time_map(slot, scratch, sunvox.api.TIME_MAP.FRAMECNT)
+                # FRAMECNT entries are 32-bit and wrap around on long songs;
+                # differences between them do not, so the offsets are summed
+                # up from those.
+                offsets[0] = scratch[0]
+                np.cumsum(np.diff(scratch), dtype=np.int64, out=offsets[1:lines])
+                offsets[1:lines] += offsets[0]
+                read_time_map(slot, scratch, sunvox.api.TIME_MAP.SPEED)
+                speeds[:lines] = scratch
+                speeds[lines] = speeds[lines - 1]
+            else:
+                speeds[0] = 0
+            offsets[lines] = slot.get_song_length_frames()
+        finally:
+            if pool is not None:
+                pool.release(scratch)
+        return cls(buffer=buffer)
+
+    @property
+    def lines(self) -> int:
+        return self.buffer.shape[1] - 1
+
+    @property
+    def song_length_frames(self) -> int:
+        return int(self.buffer[0, -1])
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self.buffer[0]
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.buffer[0, :-1]
+
+    @property
+    def speeds(self) -> np.ndarray:
+        return self.buffer[1, :-1]
+
+    @property
+    def bpm(self) -> np.ndarray:
+        return self.speeds & BPM_MASK
+
+    @property
+    def tpl(self) -> np.ndarray:
+        return self.speeds >> TPL_SHIFT
+
+    def line_frame(self, line: int) -> int:
+        """The frame `line` starts at; the song length past the last line."""
+        return int(self.offsets[min(max(line, 0), self.lines)])
+
+    def line_frames(self, lines: np.ndarray) -> np.ndarray:
+        return self.offsets[np.clip(lines, 0, self.lines)]
+
+    def frame_line(self, frame: int) -> int:
+        """The line playing at `frame`, clamped to the lines of the song."""
+        return int(self.frame_lines(frame))
+
+    def frame_lines(self, frames: np.ndarray) -> np.ndarray:
+        lines = np.searchsorted(self.starts, frames, side="right") - 1
+        return np.clip(lines, 0, max(self.lines - 1, 0))
+
+
+def read_time_map(slot: sunvox.api.Slot, dest: np.ndarray, flags: int):
+    result = slot.get_time_map(
+        start_line=0,
+        len=len(dest),
+        dest=dest.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)),
+        flags=flags,
+    )
+    log.debug("get_time_map %r result %r", flags, result)